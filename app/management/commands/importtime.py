@@ -0,0 +1,47 @@
+import os
+import subprocess
+import sys
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+SETUP = ['-c', 'import django; django.setup()']
+
+
+def profile(args):
+    """Run python -X importtime with `args`; return (package, self_us, cumulative_us, depth) rows."""
+    cmd = [sys.executable, '-X', 'importtime'] + args
+    result = subprocess.run(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True,
+                            cwd=settings.BASE_DIR, env=os.environ.copy())
+    rows = []
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'imported package' in line:
+            continue
+        self_us, cumulative_us, package = line[len('import time:'):].split('|')
+        depth = (len(package) - len(package.lstrip(' ')) - 1) // 2
+        rows.append((package.strip(), int(self_us), int(cumulative_us), depth))
+    return rows
+
+
+def total_ms(rows):
+    return sum(cumulative for package, self_us, cumulative, depth in rows if depth == 0) / 1000
+
+
+class Command(BaseCommand):
+    help = 'profiles import time of django.setup() (or a manage.py command) with python -X importtime'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--command', help='Profile `manage.py COMMAND` instead of django.setup()')
+        parser.add_argument('--top', type=int, default=15, help='Number of slowest top-level imports to show')
+        parser.add_argument('--budget', type=float, default=settings.IMPORT_TIME_BUDGET_MS,
+                            help='Fail if total import time exceeds this many milliseconds')
+
+    def handle(self, *args, **options):
+        args = ['manage.py', options['command']] if options['command'] else SETUP
+        rows = profile(args)
+        top_level = sorted((row for row in rows if row[3] == 0), key=lambda row: row[2], reverse=True)
+        for package, self_us, cumulative, depth in top_level[:options['top']]:
+            self.stdout.write(f'{cumulative / 1000:9.1f} ms  {package}')
+        total = total_ms(rows)
+        self.stdout.write(f'{total:9.1f} ms  total ({len(rows)} modules)')
+        if options['budget'] and total > options['budget']:
+            raise CommandError(f'import time {total:.1f} ms exceeds budget of {options["budget"]:.0f} ms')
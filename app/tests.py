@@ -1,6 +1,8 @@
 # -*- coding: utf-8 -*-
+from django.conf import settings
 from django.test import SimpleTestCase
 from django.test import Client
+from app.management.commands.importtime import SETUP, profile, total_ms
 client = Client()
 
 
@@ -9,3 +11,17 @@ class HealthEndpointTests(SimpleTestCase):
         response = self.client.get('/health/')
         self.assertEqual(response.status_code, 200)
         self.assertContains(response, '{"status": "UP"}')
+
+
+class ImportTimeTests(SimpleTestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.rows = profile(SETUP)
+
+    def test_setup_does_not_import_tei_parser(self):
+        packages = {package for package, self_us, cumulative, depth in self.rows}
+        self.assertFalse(packages & {'bs4', 'dateutil', 'lxml'})
+
+    def test_setup_is_within_budget(self):
+        self.assertLess(total_ms(self.rows), settings.IMPORT_TIME_BUDGET_MS)
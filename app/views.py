@@ -4,6 +4,7 @@ from django.shortcuts import render
 from rest_framework.decorators import api_view
 from drf_spectacular.utils import extend_schema, OpenApiExample
 from drf_spectacular.types import OpenApiTypes
+from medseer.views import browse
 
 
 @extend_schema(
@@ -23,7 +24,7 @@ def health(request):
 
 
 def index(request):
-    return render(request, 'index.html')
+    return browse(request)
 
 
 def handler404(request):
@@ -0,0 +1,21 @@
+# Picked up automatically by gunicorn when started from the project root
+# (see manifest.yml and `python manage.py start`)
+import os
+
+# Keep honouring gunicorn's own WEB_CONCURRENCY when GUNICORN_WORKERS isn't set
+workers = int(os.environ.get('GUNICORN_WORKERS', os.environ.get('WEB_CONCURRENCY', 1)))
+
+# Load the Django application once in the master and fork workers from it,
+# so each worker starts without re-importing the project
+preload_app = os.environ.get('GUNICORN_PRELOAD', 'true').lower() in ('1', 'true', 'yes')
+
+
+def when_ready(server):
+    if not preload_app:
+        return
+    # Django imports the URLconf (admin, API schema views) and the TEI parser
+    # on first use; do it before forking so workers share them
+    from django.urls import get_resolver
+    get_resolver().url_patterns
+    import bs4  # noqa: F401
+    import dateutil.parser  # noqa: F401
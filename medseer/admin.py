@@ -1,5 +1,7 @@
 from import_export.fields import Field
-from django.contrib import admin
+from django.contrib import admin, messages
+from django.core.exceptions import ValidationError
+from django.db import DataError, IntegrityError, transaction
 from django.http import HttpResponseRedirect
 from django.shortcuts import get_object_or_404
 from django.urls import path, reverse
@@ -7,7 +9,11 @@ from django.utils.html import format_html
 from import_export import resources
 from import_export.admin import ImportExportActionModelAdmin
 
-from .models import Author, Journal, Organization, Paper
+from . import duplicates
+from .models import Author, DuplicateCandidate, Journal, Organization, Paper
+from .profiling import profiled
+from .routers import read_only
+from .tei import TEIError
 
 
 class PaperInline(admin.TabularInline):
@@ -33,7 +39,7 @@ class JournalAdmin(admin.ModelAdmin):
     list_filter = ('rank', 'created_at', 'modified_at')
     ordering = ('name', '-rank', '-created_at', '-modified_at')
     readonly_fields = ('created_at', 'modified_at')
-    search_fields = ('name', 'rank')
+    search_fields = ('name',)
 
 
 class AuthorInline(admin.TabularInline):
@@ -60,7 +66,7 @@ class OrganizationAdmin(admin.ModelAdmin):
     list_filter = ('rank', 'created_at', 'modified_at')
     ordering = ('name', '-rank', '-created_at', '-modified_at')
     readonly_fields = ('created_at', 'modified_at')
-    search_fields = ('name', 'rank')
+    search_fields = ('name',)
 
 
 @admin.register(Author)
@@ -83,7 +89,7 @@ class AuthorAdmin(admin.ModelAdmin):
     list_filter = ('created_at', 'modified_at', 'organization')
     ordering = ('forename', 'surname', '-created_at', '-modified_at')
     readonly_fields = ('created_at', 'modified_at')
-    search_fields = ('name', 'rank')
+    search_fields = ('forename', 'surname', 'email')
 
 
 class ImportPaperResource(resources.ModelResource):
@@ -116,7 +122,7 @@ class PaperAdmin(ImportExportActionModelAdmin):
     date_hierarchy = 'modified_at'
     fieldsets = (
         (None,                {
-            'fields': (('pdf', 'grobid_button'), ('tei', 'parse_button'))}),
+            'fields': (('pdf', 'grobid_button'), ('tei', 'parse_button'), 'tei_status')}),
         ('Paper information', {
             'fields': ('title', 'abstract', 'journal', 'published_at', 'doi', 'url', 'authors')}),
         ('Date information',  {
@@ -125,18 +131,24 @@ class PaperAdmin(ImportExportActionModelAdmin):
     )
     filter_horizontal = ('authors',)
     list_display = ('title', 'doi', 'url', 'journal', 'published_at',
-                    'created_at', 'modified_at')
+                    'tei_status', 'created_at', 'modified_at')
     list_display_links = ('title', 'doi')
-    list_filter = ('published_at', 'created_at',
+    list_filter = ('tei_status', 'published_at', 'created_at',
                    'modified_at', 'journal', 'authors')
-    ordering = ('title', '-created_at', '-modified_at')
-    readonly_fields = ('grobid_button', 'parse_button',
+    # Newest first is served by the created_at index; sorting by title
+    # remains available from the column header
+    ordering = ('-created_at', '-modified_at')
+    readonly_fields = ('grobid_button', 'parse_button', 'tei_status',
                        'created_at', 'modified_at')
-    search_fields = ('title', 'abstract', 'doi', 'url', 'authors', 'journal')
+    search_fields = ('title', 'abstract', 'doi', 'url', 'authors__surname', 'journal__name')
 
     def get_export_resource_class(self):
         return ExportPaperResource
 
+    @read_only()
+    def get_export_data(self, *args, **kwargs):
+        return super().get_export_data(*args, **kwargs)
+
     @staticmethod
     def button(label, enabled):
         return f'<a class="button default" {"href={}" if enabled else "disabled"}>{label}</a>'
@@ -157,13 +169,74 @@ class PaperAdmin(ImportExportActionModelAdmin):
         ]
         return custom_urls + urls
 
+    @profiled('PaperAdmin.parse_tei_view')
     def parse_tei_view(self, request, **kwargs):
         paper_id = kwargs['object_id']
         paper = get_object_or_404(Paper, pk=paper_id)
-        paper.parse_tei().save()
+        error = self.parse_paper(paper)
+        if error:
+            self.message_user(request, f'Could not parse TEI: {error}', messages.ERROR)
         return HttpResponseRedirect(reverse('admin:medseer_paper_change', args=(paper_id,)))
 
+    @staticmethod
+    def parse_paper(paper):
+        """Parse and save the paper's TEI in its own transaction; returns why it failed, if it did."""
+        try:
+            # set_authors() writes before the paper is saved, so undo it all
+            # when the title or DOI turns out to belong to another paper
+            with transaction.atomic():
+                paper.parse_tei().save()
+        except TEIError as e:
+            paper.save(update_fields=('tei_status', 'tei_checked'))
+            return e.reason
+        except (IntegrityError, DataError, ValidationError) as e:
+            return str(e)
+        return None
+
     @admin.action(description='Parse TEI of selected papers')
+    @profiled('PaperAdmin.parse_tei')
     def parse_tei(self, request, queryset):
-        for paper in queryset.all():
-            paper.parse_tei().save()
+        parsed, skipped, failed = 0, 0, []
+        for paper in queryset.exclude(tei=''):
+            # Files validate_tei (or an earlier parse) found bad are not worth reopening
+            if paper.tei_known_bad:
+                skipped += 1
+                continue
+            error = self.parse_paper(paper)
+            if error:
+                failed.append(f'{paper.tei.name} ({error})')
+            else:
+                parsed += 1
+        self.message_user(request, f'Parsed {parsed} papers, skipped {skipped} with known-bad TEI')
+        if failed:
+            self.message_user(request, f'Could not parse {len(failed)} TEI files: {", ".join(failed)}',
+                              messages.WARNING)
+
+
+@admin.register(DuplicateCandidate)
+class DuplicateCandidateAdmin(admin.ModelAdmin):
+    actions = ['merge', 'dismiss']
+    actions_on_top = True
+    list_display = ('duplicate', 'paper', 'similarity', 'same_title', 'dismissed', 'created_at')
+    list_filter = ('dismissed', 'same_title', 'created_at')
+    list_select_related = ('paper', 'duplicate')
+    raw_id_fields = ('paper', 'duplicate')
+    readonly_fields = ('similarity', 'same_title', 'created_at')
+    search_fields = ('paper__title', 'duplicate__title')
+
+    @admin.action(description='Merge newer paper into older one')
+    def merge(self, request, queryset):
+        merged = set()
+        for candidate in queryset.select_related('paper', 'duplicate'):
+            # Merging a pair may have deleted a paper of a later one, or filled in the other
+            if {candidate.paper_id, candidate.duplicate_id} & merged:
+                continue
+            candidate.paper.refresh_from_db()
+            candidate.duplicate.refresh_from_db()
+            duplicates.merge(candidate.paper, candidate.duplicate)
+            merged.add(candidate.duplicate_id)
+        self.message_user(request, f'Merged {len(merged)} papers')
+
+    @admin.action(description='Dismiss selected candidates')
+    def dismiss(self, request, queryset):
+        self.message_user(request, f'Dismissed {queryset.update(dismissed=True)} candidates')
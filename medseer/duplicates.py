@@ -0,0 +1,150 @@
+"""Near-duplicate detection of papers.
+
+Each paper is fingerprinted by a hash of its normalized title and a MinHash
+signature of the word shingles of its title and abstract. The signature is
+cut into LSH bands whose hashes (buckets) are indexed, so finding papers
+likely to be similar costs a few index lookups regardless of corpus size.
+"""
+import hashlib
+import re
+import struct
+import unicodedata
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
+
+from .models import DuplicateCandidate, PaperBucket, PaperFingerprint
+
+PERMUTATIONS = 64
+# 16 bands of 4 rows: pairs above ~0.6 similarity almost always share a
+# bucket, pairs below ~0.3 rarely do
+BANDS = 16
+ROWS = PERMUTATIONS // BANDS
+SHINGLE_SIZE = 3
+SIGNATURE = struct.Struct(f'<{PERMUTATIONS}I')
+# Each blake2b digest yields 16 of the hash functions
+PERSONS = [f'medseer{i}'.encode() for i in range(PERMUTATIONS // 16)]
+
+
+def normalize(text):
+    """Lowercase words of `text` without accents or punctuation."""
+    text = unicodedata.normalize('NFKD', text or '')
+    text = ''.join(c for c in text if not unicodedata.combining(c))
+    return ' '.join(re.findall(r'[^\W_]+', text.lower()))
+
+
+def key(data):
+    """Signed 64-bit hash of `data`, to fit a BigIntegerField."""
+    return int.from_bytes(hashlib.blake2b(data, digest_size=8).digest(), 'big', signed=True)
+
+
+def shingles(text):
+    words = normalize(text).split()
+    if not words:
+        return set()
+    return {' '.join(words[i:i + SHINGLE_SIZE]) for i in range(max(1, len(words) - SHINGLE_SIZE + 1))}
+
+
+def minhash(text):
+    """MinHash signature of `text`, or None if it has no words."""
+    hashes = [SIGNATURE.unpack(b''.join(hashlib.blake2b(shingle.encode(), person=person).digest()
+                                        for person in PERSONS))
+              for shingle in shingles(text)]
+    return tuple(map(min, zip(*hashes))) or None
+
+
+def fingerprint(title, abstract):
+    """(title key, signature) of a paper; either is None when there's no text for it."""
+    title_key = normalize(title)
+    return (key(title_key.encode()) if title_key else None,
+            minhash(f'{title or ""} {abstract or ""}'))
+
+
+def buckets(signature):
+    return [key(struct.pack(f'<B{ROWS}I', band, *signature[band * ROWS:(band + 1) * ROWS]))
+            for band in range(BANDS)]
+
+
+def similarity(signature, other):
+    """Estimated Jaccard similarity of the shingles behind two signatures."""
+    return sum(a == b for a, b in zip(signature, other)) / PERMUTATIONS
+
+
+def match(title_key, signature, exclude=()):
+    """[(paper id, similarity, same title)] of indexed papers likely duplicating the fingerprint."""
+    matches = Q()
+    if title_key is not None:
+        matches |= Q(title_key=title_key)
+    if signature:
+        matches |= Q(paper__in=PaperBucket.objects.filter(bucket__in=buckets(signature)).values('paper'))
+    if not matches:
+        return []
+    found = []
+    for paper_id, other_key, other in (PaperFingerprint.objects.filter(matches).exclude(paper__in=exclude)
+                                       .values_list('paper_id', 'title_key', 'minhash')):
+        same_title = title_key is not None and other_key == title_key
+        score = similarity(signature, SIGNATURE.unpack(bytes(other))) if signature and other else 0.0
+        if same_title or score >= settings.DUPLICATE_THRESHOLD:
+            found.append((paper_id, score, same_title))
+    return sorted(found, key=lambda candidate: candidate[1], reverse=True)
+
+
+def candidates(title, abstract, exclude=()):
+    """Indexed papers likely duplicating a paper with the given title and abstract."""
+    return match(*fingerprint(title, abstract), exclude=exclude)
+
+
+def index(papers):
+    """Fingerprint `papers` and record the duplicate candidates they form with indexed papers.
+
+    Papers whose title and abstract are unchanged since they were last indexed are skipped.
+    """
+    indexed = {paper_id: (title_key, bytes(signature or b'')) for paper_id, title_key, signature in
+               PaperFingerprint.objects.filter(paper__in=[paper.pk for paper in papers])
+               .values_list('paper_id', 'title_key', 'minhash')}
+    changed = {}
+    for paper in papers:
+        title_key, signature = fingerprint(paper.title, paper.abstract)
+        if indexed.get(paper.pk) != (title_key, SIGNATURE.pack(*signature) if signature else b''):
+            changed[paper.pk] = title_key, signature
+    if not changed:
+        return []
+
+    with transaction.atomic():
+        DuplicateCandidate.objects.filter(Q(paper__in=changed) | Q(duplicate__in=changed), dismissed=False).delete()
+        PaperBucket.objects.filter(paper__in=changed).delete()
+        PaperFingerprint.objects.filter(paper__in=changed).delete()
+        PaperFingerprint.objects.bulk_create(
+            PaperFingerprint(paper_id=paper_id, title_key=title_key,
+                             minhash=SIGNATURE.pack(*signature) if signature else b'')
+            for paper_id, (title_key, signature) in changed.items())
+        PaperBucket.objects.bulk_create(
+            PaperBucket(paper_id=paper_id, bucket=bucket)
+            for paper_id, (title_key, signature) in changed.items() if signature
+            for bucket in buckets(signature))
+        found = {}
+        for paper_id, (title_key, signature) in changed.items():
+            for other_id, score, same_title in match(title_key, signature, exclude=[paper_id]):
+                pair = min(paper_id, other_id), max(paper_id, other_id)
+                found[pair] = DuplicateCandidate(paper_id=pair[0], duplicate_id=pair[1],
+                                                 similarity=score, same_title=same_title)
+        # Dismissed pairs stay dismissed
+        DuplicateCandidate.objects.bulk_create(found.values(), ignore_conflicts=True)
+    return list(found.values())
+
+
+def merge(paper, duplicate):
+    """Fold `duplicate` into `paper`: fill in the paper's blank fields and authors, then delete it."""
+    authors = list(duplicate.authors.all())
+    for field in ('pdf', 'abstract', 'doi', 'url', 'journal_id', 'published_at'):
+        if not getattr(paper, field) and getattr(duplicate, field):
+            setattr(paper, field, getattr(duplicate, field))
+    if not paper.tei and duplicate.tei:
+        paper.tei, paper.tei_status, paper.tei_checked = duplicate.tei, duplicate.tei_status, duplicate.tei_checked
+    with transaction.atomic():
+        # Deleted first, as its DOI and URL are unique
+        duplicate.delete()
+        paper.save()
+        paper.authors.add(*authors)
+    return paper
@@ -0,0 +1,182 @@
+import asyncio
+import json
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, timedelta
+from urllib.parse import quote, urlsplit
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models.functions import Lower
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from . import facets
+from .models import Change, Journal, MetadataResponse, Paper
+from .tei import parse as extract_tei
+
+
+class CrossrefSource:
+    """Looks papers up by DOI in the Crossref REST API (or anything speaking its format)."""
+
+    def __init__(self, base_url='https://api.crossref.org/works/'):
+        self.base_url = base_url
+
+    def url(self, doi):
+        return self.base_url + quote(doi, safe='/')
+
+    def parse(self, body):
+        message = json.loads(body)['message']
+        date_parts = (message.get('published') or message.get('issued') or {}).get('date-parts') or [[]]
+        date_parts = [part for part in date_parts[0] if part is not None]
+        return {
+            'journal': next(iter(message.get('container-title') or []), None),
+            'published_at': date(*(date_parts + [1, 1])[:3]) if date_parts else None,
+            'url': message.get('URL'),
+        }
+
+
+def get_source():
+    return import_string(settings.ENRICHMENT_SOURCE)(settings.ENRICHMENT_URL)
+
+
+class RateLimiter:
+    """Spaces out requests to each host to at most `rate` per second."""
+
+    def __init__(self, rate):
+        self.interval = 1 / rate
+        self.next_slot = {}
+
+    async def wait(self, host):
+        now = asyncio.get_running_loop().time()
+        slot = max(now, self.next_slot.get(host, now))
+        self.next_slot[host] = slot + self.interval
+        await asyncio.sleep(slot - now)
+
+
+def get(url, timeout):
+    """Return (status, body); status is None on network errors so they aren't cached."""
+    request = urllib.request.Request(url, headers={'User-Agent': 'medseer', 'Accept': 'application/json'})
+    try:
+        with urllib.request.urlopen(request, timeout=timeout) as response:
+            return response.status, response.read().decode()
+    except urllib.error.HTTPError as e:
+        return e.code, ''
+    except (urllib.error.URLError, OSError):
+        return None, ''
+
+
+async def fetch_all(urls, concurrency, rate, timeout=10):
+    """Fetch `urls` with at most `concurrency` requests in flight and `rate` per second per host."""
+    semaphore = asyncio.Semaphore(concurrency)
+    limiter = RateLimiter(rate)
+    loop = asyncio.get_running_loop()
+
+    with ThreadPoolExecutor(concurrency) as executor:
+        async def fetch(url):
+            async with semaphore:
+                await limiter.wait(urlsplit(url).netloc)
+                return url, await loop.run_in_executor(executor, get, url, timeout)
+
+        return dict(await asyncio.gather(*(fetch(url) for url in urls)))
+
+
+def cached_fetch(urls, concurrency, rate):
+    """Return {url: (status, body)}, serving fresh cached responses and fetching the rest."""
+    now = timezone.now()
+    fresh = now - timedelta(seconds=settings.ENRICHMENT_CACHE_TTL)
+    cached = MetadataResponse.objects.filter(url__in=urls, fetched_at__gte=fresh)
+    responses = {response.url: (response.status, response.body) for response in cached}
+    MetadataResponse.objects.filter(url__in=responses).update(used_at=now)
+
+    missing = [url for url in urls if url not in responses]
+    fetched = asyncio.run(fetch_all(missing, concurrency, rate)) if missing else {}
+    fetched = {url: response for url, response in fetched.items() if response[0] is not None}
+    with transaction.atomic():
+        MetadataResponse.objects.filter(url__in=fetched).delete()
+        MetadataResponse.objects.bulk_create(
+            MetadataResponse(url=url, status=status, body=body, fetched_at=now, used_at=now)
+            for url, (status, body) in fetched.items())
+    evict()
+    responses.update(fetched)
+    return responses
+
+
+def evict():
+    """Drop least recently used responses beyond ENRICHMENT_CACHE_SIZE."""
+    excess = MetadataResponse.objects.count() - settings.ENRICHMENT_CACHE_SIZE
+    if excess > 0:
+        stale = list(MetadataResponse.objects.order_by('used_at').values_list('id', flat=True)[:excess])
+        MetadataResponse.objects.filter(id__in=stale).delete()
+
+
+def extract_dois(papers):
+    """Fill in missing DOIs from the papers' TEI, skipping DOIs another paper already has."""
+    found, seen = {}, set()
+    for paper in papers:
+        if paper.doi or not paper.tei or paper.tei_known_bad:
+            continue
+        try:
+            doi = extract_tei(paper.tei)['doi']
+        except Exception:
+            continue
+        if doi and doi.lower() not in seen:
+            found[paper] = doi
+            seen.add(doi.lower())
+    # DOIs are unique regardless of case, which the index on LOWER(doi) serves
+    taken = set(Paper.objects.annotate(doi_lower=Lower('doi')).filter(doi_lower__in=seen)
+                .values_list('doi_lower', flat=True))
+    for paper, doi in found.items():
+        if doi.lower() not in taken:
+            paper.doi = doi
+    return [paper for paper in found if paper.doi]
+
+
+def enrich(papers, source=None, concurrency=None, rate=None):
+    """Fill in DOI, journal, publication date and URL of `papers`; returns the updated papers."""
+    source = source or get_source()
+    updated = set(extract_dois(papers))
+    urls = {paper: source.url(paper.doi) for paper in papers if paper.doi}
+    responses = cached_fetch(sorted(set(urls.values())),
+                             concurrency or settings.ENRICHMENT_CONCURRENCY,
+                             rate or settings.ENRICHMENT_RATE)
+
+    metadata = {}
+    for paper, url in urls.items():
+        status, body = responses.get(url, (None, ''))
+        if status == 200:
+            try:
+                metadata[paper] = source.parse(body)
+            except (ValueError, KeyError, TypeError):
+                pass
+    journals = {name: Journal.objects.get_or_create(name=name)[0]
+                for name in {data['journal'] for data in metadata.values() if data['journal']}}
+    taken = set(Paper.objects.filter(url__in=[data['url'] for data in metadata.values() if data['url']])
+                .values_list('url', flat=True))
+    for paper, data in metadata.items():
+        if not paper.journal_id and data['journal']:
+            paper.journal = journals[data['journal']]
+            updated.add(paper)
+        if not paper.published_at and data['published_at']:
+            paper.published_at = data['published_at']
+            updated.add(paper)
+        if not paper.url and data['url'] and data['url'] not in taken:
+            paper.url = data['url']
+            taken.add(data['url'])
+            updated.add(paper)
+
+    # bulk_update skips save(), so keep modified_at and the change log in step by hand
+    now = timezone.now()
+    with transaction.atomic():
+        before = facets.memberships([paper.pk for paper in updated])
+        for paper in updated:
+            paper.modified_at = now
+        Paper.objects.bulk_update(updated, ('doi', 'journal', 'published_at', 'url', 'modified_at'))
+        Change.objects.bulk_create(
+            Change(model=Paper._meta.model_name, object_id=paper.pk, action=Change.UPDATED)
+            for paper in sorted(updated, key=lambda paper: paper.pk))
+        facets.apply(before, facets.memberships([paper.pk for paper in updated]))
+    if updated:
+        facets.bump()
+    return updated
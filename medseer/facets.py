@@ -0,0 +1,117 @@
+import time
+from collections import Counter, defaultdict
+
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Count, F
+from django.db.models.functions import ExtractYear, Greatest
+
+from .models import Author, FacetCount, Journal, Organization, Paper
+
+JOURNAL, YEAR, ORGANIZATION = FacetCount.JOURNAL, FacetCount.YEAR, FacetCount.ORGANIZATION
+VERSION_KEY = 'medseer:papers:version'
+
+
+def version():
+    """Number identifying the current state of the papers, for cache keys."""
+    return cache.get_or_set(VERSION_KEY, time.time_ns(), None)
+
+
+def bump():
+    try:
+        cache.incr(VERSION_KEY)
+    except ValueError:
+        # Never reuse a version that may still key cached fragments
+        cache.set(VERSION_KEY, time.time_ns(), None)
+
+
+def papers(facet, value, queryset=None):
+    """Papers counting towards a facet value, optionally narrowing `queryset`."""
+    queryset = Paper.objects.all() if queryset is None else queryset
+    if facet == JOURNAL:
+        return queryset.filter(journal_id=value)
+    if facet == YEAR:
+        return queryset.filter(published_at__year=value)
+    return queryset.filter(authors__organization_id=value).distinct()
+
+
+def label(facet, value):
+    if facet == JOURNAL:
+        return Journal.objects.get(pk=value).name
+    if facet == ORGANIZATION:
+        return Organization.objects.get(pk=value).name
+    return str(value)
+
+
+def memberships(paper_ids):
+    """{paper id: facet values it counts towards} for the given papers."""
+    found = defaultdict(set)
+    for paper_id, journal_id, published_at in (Paper.objects.filter(pk__in=paper_ids)
+                                               .values_list('pk', 'journal_id', 'published_at')):
+        if journal_id:
+            found[paper_id].add((JOURNAL, journal_id))
+        if published_at:
+            found[paper_id].add((YEAR, published_at.year))
+    # Authors whose TEI has no orgName share an unnamed organization
+    for paper_id, organization_id in (Paper.authors.through.objects
+                                      .filter(paper_id__in=paper_ids, author__organization__isnull=False)
+                                      .exclude(author__organization__name='')
+                                      .values_list('paper_id', 'author__organization_id')):
+        found[paper_id].add((ORGANIZATION, organization_id))
+    return found
+
+
+def apply(before, after):
+    """Adjust counts by how the papers' memberships changed from `before` to `after`.
+
+    Counts move by deltas rather than being recounted, so concurrent writers
+    don't overwrite each other and a change costs O(values it touches).
+    """
+    deltas = Counter()
+    for paper_id in before.keys() | after.keys():
+        old, new = before.get(paper_id, set()), after.get(paper_id, set())
+        deltas.update(new - old)
+        deltas.subtract(old - new)
+    for (facet, value), delta in deltas.items():
+        if delta > 0:
+            FacetCount.objects.get_or_create(facet=facet, value=value,
+                                             defaults={'count': 0, 'label': label(facet, value)})
+        if delta:
+            FacetCount.objects.filter(facet=facet, value=value).update(count=Greatest(F('count') + delta, 0))
+        if delta < 0:
+            # The update above holds the row lock, so no concurrent increment is lost
+            FacetCount.objects.filter(facet=facet, value=value, count__lte=0).delete()
+    if any(deltas.values()):
+        bump()
+
+
+def compute():
+    """Every facet count, computed from scratch."""
+    papers = Paper.objects
+    journals = (papers.filter(journal__isnull=False).values_list('journal_id', 'journal__name')
+                .annotate(count=Count('id')).order_by())
+    years = (papers.filter(published_at__isnull=False).annotate(year=ExtractYear('published_at'))
+             .values_list('year').annotate(count=Count('id')).order_by())
+    organizations = (papers.filter(authors__organization__isnull=False)
+                     .exclude(authors__organization__name='')
+                     .values_list('authors__organization_id', 'authors__organization__name')
+                     .annotate(count=Count('id', distinct=True)).order_by())
+    counts = [FacetCount(facet=JOURNAL, value=value, label=name, count=count) for value, name, count in journals]
+    counts += [FacetCount(facet=YEAR, value=year, label=str(year), count=count) for year, count in years]
+    counts += [FacetCount(facet=ORGANIZATION, value=value, label=name, count=count)
+               for value, name, count in organizations]
+    return counts
+
+
+def rebuild():
+    """Recompute every facet count from scratch."""
+    counts = compute()
+    with transaction.atomic():
+        FacetCount.objects.all().delete()
+        FacetCount.objects.bulk_create(counts)
+    bump()
+    return len(counts)
+
+
+def top(facet, limit=20):
+    return list(FacetCount.objects.filter(facet=facet).order_by('-count', 'label')[:limit])
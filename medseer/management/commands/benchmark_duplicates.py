@@ -0,0 +1,70 @@
+import random
+import string
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from medseer import duplicates
+from medseer.models import Paper, PaperFingerprint
+
+
+class Command(BaseCommand):
+    help = ('times near-duplicate lookups against a linear scan over a synthetic corpus; '
+            'everything is rolled back afterwards')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--papers', type=int, default=20000, help='Size of the synthetic corpus')
+        parser.add_argument('--queries', type=int, default=200, help='Near-duplicates looked up')
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        self.random = random.Random(options['seed'])
+        self.vocabulary = [''.join(self.random.choices(string.ascii_lowercase, k=self.random.randint(3, 10)))
+                           for _ in range(5000)]
+        with transaction.atomic():
+            self.benchmark(options['papers'], options['queries'])
+            transaction.set_rollback(True)
+
+    def text(self, words):
+        return ' '.join(self.random.choices(self.vocabulary, k=words))
+
+    def variant(self, paper):
+        """The same paper as a differently punctuated, lightly edited preprint."""
+        words = paper.abstract.split()
+        for i in self.random.sample(range(len(words)), len(words) // 20):
+            words[i] = self.random.choice(self.vocabulary)
+        return paper.title.title().replace(' ', ', ', 1) + '.', ' '.join(words)
+
+    def benchmark(self, size, queries):
+        start = time.perf_counter()
+        papers = Paper.objects.bulk_create(
+            (Paper(title=self.text(self.random.randint(6, 14)), abstract=self.text(self.random.randint(80, 200)))
+             for _ in range(size)), batch_size=1000)
+        for i in range(0, size, 1000):
+            duplicates.index(papers[i:i + 1000])
+        self.stdout.write(f'Indexed {size} papers in {time.perf_counter() - start:.1f}s')
+
+        sample = self.random.sample(papers, min(queries, size))
+        variants = [self.variant(paper) for paper in sample]
+        unrelated = [(self.text(10), self.text(150)) for _ in sample]
+
+        start = time.perf_counter()
+        found = sum(paper.pk in {paper_id for paper_id, score, same_title in duplicates.candidates(*variant)}
+                    for paper, variant in zip(sample, variants))
+        indexed = (time.perf_counter() - start) / len(sample)
+        false = sum(bool(duplicates.candidates(*text)) for text in unrelated)
+
+        signatures = [(paper_id, duplicates.SIGNATURE.unpack(bytes(signature))) for paper_id, signature in
+                      PaperFingerprint.objects.values_list('paper_id', 'minhash')]
+        start = time.perf_counter()
+        for title, abstract in variants:
+            signature = duplicates.minhash(f'{title} {abstract}')
+            matches = [paper_id for paper_id, other in signatures
+                       if duplicates.similarity(signature, other) >= settings.DUPLICATE_THRESHOLD]
+        scan = (time.perf_counter() - start) / len(sample)
+
+        self.stdout.write(f'Indexed lookup: {indexed * 1000:.2f} ms/query, '
+                          f'found {found}/{len(sample)} near-duplicates, {false} false matches')
+        self.stdout.write(f'Linear scan (signatures preloaded): {scan * 1000:.2f} ms/query')
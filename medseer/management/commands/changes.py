@@ -0,0 +1,21 @@
+import json
+
+from django.core.management.base import BaseCommand
+from django.core.serializers.json import DjangoJSONEncoder
+
+from medseer.sync import iter_changes, latest_cursor
+
+
+class Command(BaseCommand):
+    help = 'writes changes after a cursor as newline-delimited JSON, reading in batches'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--since', type=int, default=0, help='Cursor of the last change already consumed')
+        parser.add_argument('--limit', type=int, default=None, help='Maximum number of changes to write')
+        parser.add_argument('--batch-size', type=int, default=1000, help='Number of changes read per query')
+
+    def handle(self, *args, **options):
+        until = latest_cursor(options['since'], options['limit'])
+        for change in iter_changes(options['since'], until, options['batch_size']):
+            self.stdout.write(json.dumps(change, cls=DjangoJSONEncoder))
+        self.stderr.write(f'cursor: {until}')
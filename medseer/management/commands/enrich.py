@@ -0,0 +1,30 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db.models import Q
+
+from medseer.enrichment import enrich
+from medseer.models import INCOMPLETE, Paper
+
+
+class Command(BaseCommand):
+    help = 'fills in DOI, journal, publication date and URL of papers from the metadata source'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=200, help='Papers looked up and updated per batch')
+        parser.add_argument('--concurrency', type=int, default=settings.ENRICHMENT_CONCURRENCY,
+                            help='Maximum requests in flight')
+        parser.add_argument('--rate', type=float, default=settings.ENRICHMENT_RATE,
+                            help='Maximum requests per second per host')
+
+    def handle(self, *args, **options):
+        incomplete = Paper.objects.filter(INCOMPLETE).exclude(Q(doi__isnull=True) & Q(tei=''))
+        cursor, total = 0, 0
+        while True:
+            batch = list(incomplete.filter(pk__gt=cursor).order_by('pk')[:options['batch_size']])
+            if not batch:
+                break
+            updated = enrich(batch, concurrency=options['concurrency'], rate=options['rate'])
+            total += len(updated)
+            cursor = batch[-1].pk
+            self.stdout.write(f'{len(updated)} of {len(batch)} papers updated')
+        self.stdout.write(self.style.SUCCESS(f'Enriched {total} papers'))
@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand
+
+from medseer import duplicates
+from medseer.models import Paper, PaperBucket, PaperFingerprint
+
+
+class Command(BaseCommand):
+    help = 'fingerprints papers for near-duplicate detection and records duplicate candidates'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rebuild', action='store_true', help='Drop all fingerprints first')
+        parser.add_argument('--batch-size', type=int, default=500, help='Papers indexed per transaction')
+
+    def handle(self, *args, **options):
+        if options['rebuild']:
+            PaperBucket.objects.all().delete()
+            PaperFingerprint.objects.all().delete()
+        papers = Paper.objects.only('title', 'abstract').order_by('pk')
+        cursor, found = 0, 0
+        while True:
+            batch = list(papers.filter(pk__gt=cursor)[:options['batch_size']])
+            if not batch:
+                break
+            found += len(duplicates.index(batch))
+            cursor = batch[-1].pk
+        self.stdout.write(self.style.SUCCESS(f'Indexed papers up to {cursor}: {found} duplicate candidates'))
@@ -0,0 +1,159 @@
+import multiprocessing
+import os
+import time
+from concurrent.futures import BrokenExecutor, ProcessPoolExecutor
+from datetime import timedelta
+
+from django.core.files import File
+from django.core.management.base import BaseCommand, CommandError
+from django.core.exceptions import ValidationError
+from django.db import DataError, IntegrityError, transaction
+
+from medseer.models import IngestCheckpoint, Paper
+from medseer.parallel import bounded_map
+from medseer.tei import VALID, read
+
+TEI_SUFFIXES = ('.tei.xml', '.xml')
+PDF_SUFFIX = '.pdf'
+
+
+def split_name(name):
+    """Return (stem, kind) for files ingest cares about, else None."""
+    lower = name.lower()
+    for suffix in TEI_SUFFIXES:
+        if lower.endswith(suffix):
+            return name[:-len(suffix)], 'tei'
+    if lower.endswith(PDF_SUFFIX):
+        return name[:-len(PDF_SUFFIX)], 'pdf'
+    return None
+
+
+def walk(directory, checkpoint=(), key=()):
+    """Lazily yield (key, {'tei': path, 'pdf': path}) per paper under `directory`.
+
+    Files sharing a stem (e.g. paper.pdf and paper.tei.xml) form one paper. Keys
+    increase in walk order, so anything at or before `checkpoint` is skipped and
+    directories finished before the checkpoint are not even listed.
+    """
+    with os.scandir(directory) as entries:
+        entries = sorted(entries, key=lambda entry: entry.name)
+    papers, directories = {}, []
+    for entry in entries:
+        if entry.is_dir():
+            directories.append(entry)
+        elif entry.is_file() and split_name(entry.name):
+            stem, kind = split_name(entry.name)
+            papers.setdefault(stem, {}).setdefault(kind, entry.path)
+    for stem in sorted(papers):
+        paper_key = key + ((0, stem),)
+        if paper_key > checkpoint:
+            yield paper_key, papers[stem]
+    for entry in directories:
+        directory_key = key + ((1, entry.name),)
+        if directory_key < checkpoint and checkpoint[:len(directory_key)] != directory_key:
+            continue
+        yield from walk(entry.path, checkpoint, directory_key)
+
+
+def count(directory):
+    return sum(1 for _ in walk(directory))
+
+
+class Command(BaseCommand):
+    help = 'ingests a directory tree of PDF/TEI files into papers, resuming from a checkpoint'
+
+    def add_arguments(self, parser):
+        parser.add_argument('directory', help='Directory to walk for *.pdf and *.tei.xml files')
+        parser.add_argument('--restart', action='store_true', help='Discard the checkpoint and start over')
+        parser.add_argument('--jobs', type=int, default=os.cpu_count(), help='Number of parser processes')
+        parser.add_argument('--batch-size', type=int, default=100, help='Papers committed per transaction')
+        parser.add_argument('--count', action='store_true', help='Count files up front to report an ETA')
+
+    def handle(self, *args, **options):
+        directory = options['directory']
+        if not os.path.isdir(directory):
+            raise CommandError(f'{directory} is not a directory')
+        self.checkpoint, created = IngestCheckpoint.objects.get_or_create(directory=os.path.abspath(directory))
+        if options['restart']:
+            self.checkpoint.key, self.checkpoint.done = [], 0
+        elif not created:
+            self.stdout.write(f'Resuming after {self.checkpoint.done} papers')
+        checkpoint = tuple(map(tuple, self.checkpoint.key))
+        self.total = count(directory) if options['count'] else None
+        self.started, self.processed = time.monotonic(), 0
+        self.created = self.skipped = self.failed = 0
+
+        batch = []
+        # Spawned parsers import only medseer.tei and never inherit database connections
+        try:
+            with ProcessPoolExecutor(options['jobs'], multiprocessing.get_context('spawn')) as executor:
+                papers = (((key, files), files.get('tei')) for key, files in walk(directory, checkpoint))
+                for (key, files), data, error in bounded_map(executor, read, papers, options['jobs'] * 4):
+                    batch.append((key, files, data, error))
+                    if len(batch) >= options['batch_size']:
+                        self.commit(batch)
+                        batch = []
+        except BrokenExecutor as e:
+            # The checkpoint is still before the uncommitted and in-flight papers
+            raise CommandError(f'A parser process died ({e}); run again to resume after '
+                               f'{self.checkpoint.done} papers')
+        if batch:
+            self.commit(batch)
+        self.stdout.write(self.style.SUCCESS(
+            f'Ingested {self.processed} papers: {self.created} created, '
+            f'{self.skipped} skipped, {self.failed} failed'))
+
+    def commit(self, batch):
+        with transaction.atomic():
+            for key, files, data, error in batch:
+                if error:
+                    self.failed += 1
+                    self.stderr.write(f'{files.get("tei")}: {type(error).__name__}: {error}')
+                    continue
+                try:
+                    with transaction.atomic():
+                        self.create(files, data)
+                    self.created += 1
+                except IntegrityError:
+                    self.skipped += 1
+                except (DataError, ValidationError, OSError) as e:
+                    # Counted as failed so the checkpoint moves past it, or
+                    # every resumed run would stop on the same file
+                    self.failed += 1
+                    self.stderr.write(f'{files.get("tei") or files.get("pdf")}: {type(e).__name__}: {e}')
+            self.checkpoint.key = batch[-1][0]
+            self.checkpoint.done += len(batch)
+            self.checkpoint.save()
+        self.processed += len(batch)
+        self.report()
+
+    @staticmethod
+    def create(files, data):
+        paper = Paper()
+        if data:
+            paper.apply_tei(data)
+        stored = []
+        try:
+            for kind, path in files.items():
+                with open(path, 'rb') as f:
+                    getattr(paper, kind).save(os.path.basename(path), File(f), save=False)
+                stored.append(kind)
+            if data:
+                paper.mark_tei(VALID)
+            paper.save()
+            if data:
+                paper.set_authors(data['authors'])
+        except (IntegrityError, DataError, ValidationError, OSError):
+            # The transaction undoes the rows, not the copies in storage
+            for kind in stored:
+                getattr(paper, kind).delete(save=False)
+            raise
+
+    def report(self):
+        elapsed = time.monotonic() - self.started
+        rate = self.processed / elapsed if elapsed else 0
+        line = f'{self.checkpoint.done} papers, {rate:.1f}/s'
+        if self.total is not None and rate:
+            remaining = max(self.total - self.checkpoint.done, 0)
+            line += f', ETA {timedelta(seconds=round(remaining / rate))}'
+        self.stdout.write(line)
@@ -0,0 +1,29 @@
+import heapq
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from medseer.profiling import read_log
+
+
+class Command(BaseCommand):
+    help = 'prints the slowest profiled operations and their query fingerprints from the profiling log'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--top', type=int, default=10, help='Number of operations to show')
+        parser.add_argument('--name', help='Only show operations whose name contains this text')
+        parser.add_argument('--log', default=settings.PROFILING_LOG, help='Profiling log to read')
+
+    def handle(self, *args, **options):
+        records = (record for record in read_log(options['log'])
+                   if not options['name'] or options['name'] in record['name'])
+        slowest = heapq.nlargest(options['top'], records, key=lambda record: record['wall_ms'])
+        if not slowest:
+            self.stdout.write('No profiled operations recorded')
+        for record in slowest:
+            self.stdout.write(self.style.MIGRATE_HEADING(record['name']))
+            self.stdout.write(
+                f'  {record["at"]}  wall {record["wall_ms"]:.1f} ms  cpu {record["cpu_ms"]:.1f} ms  '
+                f'{record["queries"]} queries ({record["query_ms"]:.1f} ms, {record["duplicates"]} duplicate)')
+            for sql, count, duration in record['fingerprints']:
+                self.stdout.write(f'    {count:4d}x {duration:8.1f} ms  {sql}')
@@ -0,0 +1,10 @@
+from django.core.management.base import BaseCommand
+
+from medseer.facets import rebuild
+
+
+class Command(BaseCommand):
+    help = 'recomputes the precomputed facet counts of the browse page from scratch'
+
+    def handle(self, *args, **options):
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt {rebuild()} facet counts'))
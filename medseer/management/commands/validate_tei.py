@@ -0,0 +1,66 @@
+import json
+import multiprocessing
+import os
+from collections import Counter, defaultdict
+from concurrent.futures import ProcessPoolExecutor
+
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import F
+
+from medseer.models import Paper
+from medseer.parallel import bounded_map
+from medseer.tei import VALID, validate
+
+
+class Command(BaseCommand):
+    help = 'checks stored TEI files, classifying the ones papers can\'t be parsed from'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--all', action='store_true', help='Recheck files already checked')
+        parser.add_argument('--jobs', type=int, default=os.cpu_count(), help='Number of validator processes')
+        parser.add_argument('--batch-size', type=int, default=500, help='Statuses saved per transaction')
+        parser.add_argument('--report', help='Write counts and failures as JSON to this file')
+
+    def handle(self, *args, **options):
+        papers = Paper.objects.exclude(tei='')
+        if not options['all']:
+            papers = papers.exclude(tei_checked=F('tei'))
+        self.counts, self.failures = Counter(), defaultdict(list)
+
+        batch = []
+        files = ((Paper(pk=pk, tei=name), default_storage.path(name))
+                 for pk, name in papers.order_by('pk').values_list('pk', 'tei').iterator())
+        with ProcessPoolExecutor(options['jobs'], multiprocessing.get_context('spawn')) as executor:
+            for paper, result, error in bounded_map(executor, validate, files, options['jobs'] * 4):
+                if error:
+                    # A crashed worker leaves the file unchecked, so the next run retries it
+                    status, message = 'error', f'{type(error).__name__}: {error}'
+                    paper.tei_status, paper.tei_checked = '', ''
+                else:
+                    status, message = result
+                    paper.mark_tei(status)
+                batch.append(paper)
+                self.counts[status] += 1
+                if status != VALID:
+                    self.failures[status].append([paper.pk, paper.tei.name, message])
+                if len(batch) >= options['batch_size']:
+                    self.save(batch)
+                    batch = []
+        if batch:
+            self.save(batch)
+
+        for status, count in sorted(self.counts.items()):
+            self.stdout.write(f'{status}: {count}')
+        if options['report']:
+            with open(options['report'], 'w') as f:
+                json.dump({'counts': self.counts, 'failures': self.failures}, f, indent=1)
+        checked = sum(self.counts.values())
+        self.stdout.write(self.style.SUCCESS(
+            f'Checked {checked} TEI files: {self.counts[VALID]} valid, {checked - self.counts[VALID]} invalid'))
+
+    @staticmethod
+    def save(batch):
+        with transaction.atomic():
+            Paper.objects.bulk_update(batch, ('tei_status', 'tei_checked'))
@@ -0,0 +1,24 @@
+# Generated by Django 4.2.30 on 2026-10-19 17:24
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('medseer', '0009_ingestcheckpoint'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MetadataResponse',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('url', models.CharField(max_length=500, unique=True)),
+                ('status', models.PositiveSmallIntegerField()),
+                ('body', models.TextField(blank=True)),
+                ('fetched_at', models.DateTimeField()),
+                ('used_at', models.DateTimeField(db_index=True)),
+            ],
+        ),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 4.2.30 on 2026-10-19 17:27
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('medseer', '0010_metadataresponse'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FacetCount',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('facet', models.CharField(choices=[('journal', 'Journal'), ('year', 'Year'), ('organization', 'Organization')], max_length=20)),
+                ('value', models.BigIntegerField()),
+                ('label', models.CharField(max_length=300)),
+                ('count', models.PositiveIntegerField()),
+            ],
+            options={
+                'indexes': [models.Index(fields=['facet', '-count'], name='facet_count_idx')],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='facetcount',
+            constraint=models.UniqueConstraint(fields=('facet', 'value'), name='unique_facet_value'),
+        ),
+    ]
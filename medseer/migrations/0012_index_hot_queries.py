@@ -0,0 +1,84 @@
+# Generated by Django 4.2.30 on 2026-10-19 17:29
+
+from django.db import migrations, models
+from django.db.models import Count, Min
+import django.db.models.functions.text
+
+
+def clear_case_collisions(apps, schema_editor):
+    # Titles and DOIs were only unique as typed; of those now equal but for
+    # case, the oldest paper keeps its value and the others lose it
+    Paper = apps.get_model('medseer', 'Paper')
+    for field in ('title', 'doi'):
+        key = django.db.models.functions.text.Lower(field)
+        collisions = list(Paper.objects.exclude(**{field: None}).values(key=key)
+                          .annotate(first=Min('id'), papers=Count('id')).filter(papers__gt=1))
+        for collision in collisions:
+            (Paper.objects.annotate(key=key).filter(key=collision['key'])
+             .exclude(id=collision['first']).update(**{field: None}))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('medseer', '0011_facetcount'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='author',
+            name='created_at',
+            field=models.DateTimeField(auto_now_add=True, db_index=True),
+        ),
+        migrations.AlterField(
+            model_name='author',
+            name='surname',
+            field=models.CharField(db_index=True, max_length=100),
+        ),
+        migrations.AlterField(
+            model_name='journal',
+            name='created_at',
+            field=models.DateTimeField(auto_now_add=True, db_index=True),
+        ),
+        migrations.AlterField(
+            model_name='organization',
+            name='created_at',
+            field=models.DateTimeField(auto_now_add=True, db_index=True),
+        ),
+        migrations.AlterField(
+            model_name='paper',
+            name='created_at',
+            field=models.DateTimeField(auto_now_add=True, db_index=True),
+        ),
+        migrations.AlterField(
+            model_name='paper',
+            name='doi',
+            field=models.CharField(blank=True, max_length=100, null=True),
+        ),
+        migrations.AlterField(
+            model_name='paper',
+            name='title',
+            field=models.CharField(blank=True, max_length=500, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='paper',
+            index=models.Index(fields=['-published_at', 'title'], name='paper_published_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='paper',
+            index=models.Index(fields=['journal', '-published_at', 'title'], name='paper_journal_published_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='paper',
+            index=models.Index(condition=models.Q(('doi__isnull', True), ('journal__isnull', True), ('published_at__isnull', True), ('url__isnull', True), _connector='OR'), fields=['id'], name='paper_incomplete_idx'),
+        ),
+        migrations.RunPython(clear_case_collisions, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='paper',
+            constraint=models.UniqueConstraint(django.db.models.functions.text.MD5(django.db.models.functions.text.Lower('title')), name='unique_paper_title'),
+        ),
+        migrations.AddConstraint(
+            model_name='paper',
+            constraint=models.UniqueConstraint(django.db.models.functions.text.Lower('doi'), name='unique_paper_doi'),
+        ),
+    ]
@@ -0,0 +1,39 @@
+from django.db import migrations
+
+# Trigram indexes serving the case-insensitive substring search of the
+# browse page and the admin (icontains compiles to UPPER(column::text) LIKE)
+TRIGRAM_INDEXES = (
+    ('paper_title_trgm_idx', 'medseer_paper', 'title'),
+    ('author_forename_trgm_idx', 'medseer_author', 'forename'),
+    ('author_surname_trgm_idx', 'medseer_author', 'surname'),
+    ('author_email_trgm_idx', 'medseer_author', 'email'),
+    ('journal_name_trgm_idx', 'medseer_journal', 'name'),
+    ('organization_name_trgm_idx', 'medseer_organization', 'name'),
+)
+
+
+def create_trigram_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    for name, table, column in TRIGRAM_INDEXES:
+        schema_editor.execute(
+            f'CREATE INDEX IF NOT EXISTS {name} ON {table} USING gin (UPPER({column}::text) gin_trgm_ops)')
+
+
+def drop_trigram_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    for name, table, column in TRIGRAM_INDEXES:
+        schema_editor.execute(f'DROP INDEX IF EXISTS {name}')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('medseer', '0012_index_hot_queries'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_trigram_indexes, drop_trigram_indexes),
+    ]
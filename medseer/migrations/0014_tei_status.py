@@ -0,0 +1,23 @@
+# Generated by Django 4.2.30 on 2026-10-19 17:33
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('medseer', '0013_trigram_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='paper',
+            name='tei_checked',
+            field=models.CharField(blank=True, max_length=100),
+        ),
+        migrations.AddField(
+            model_name='paper',
+            name='tei_status',
+            field=models.CharField(blank=True, choices=[('valid', 'Valid'), ('unreadable', 'Unreadable file'), ('malformed', 'Malformed XML'), ('missing_title', 'Missing title'), ('missing_abstract', 'Missing abstract'), ('bad_date', 'Bad publication date')], max_length=20),
+        ),
+    ]
@@ -0,0 +1,35 @@
+from django.db import migrations
+from django.db.models import Count
+from django.db.models.functions import ExtractYear
+
+
+def populate_facet_counts(apps, schema_editor):
+    # 0011 created the table empty; signals only keep counts up to date
+    # from there, so count the papers that already existed
+    Paper = apps.get_model('medseer', 'Paper')
+    FacetCount = apps.get_model('medseer', 'FacetCount')
+    journals = (Paper.objects.filter(journal__isnull=False).values_list('journal_id', 'journal__name')
+                .annotate(count=Count('id')).order_by())
+    years = (Paper.objects.filter(published_at__isnull=False).annotate(year=ExtractYear('published_at'))
+             .values_list('year').annotate(count=Count('id')).order_by())
+    organizations = (Paper.objects.filter(authors__organization__isnull=False)
+                     .exclude(authors__organization__name='')
+                     .values_list('authors__organization_id', 'authors__organization__name')
+                     .annotate(count=Count('id', distinct=True)).order_by())
+    counts = [FacetCount(facet='journal', value=value, label=name, count=count) for value, name, count in journals]
+    counts += [FacetCount(facet='year', value=year, label=str(year), count=count) for year, count in years]
+    counts += [FacetCount(facet='organization', value=value, label=name, count=count)
+               for value, name, count in organizations]
+    FacetCount.objects.all().delete()
+    FacetCount.objects.bulk_create(counts)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('medseer', '0015_duplicates'),
+    ]
+
+    operations = [
+        migrations.RunPython(populate_facet_counts, migrations.RunPython.noop),
+    ]
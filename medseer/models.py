@@ -1,14 +1,16 @@
-from bs4 import BeautifulSoup
-from dateutil import parser
 from django.core.validators import FileExtensionValidator
 from django.db import IntegrityError, models
+from django.db.models.functions import MD5, Lower
+
+from .profiling import profiled
+from . import tei as tei_document
 
 
 class Journal(models.Model):
     name = models.CharField(max_length=300, unique=True)
     rank = models.PositiveSmallIntegerField(default=0)
-    created_at = models.DateTimeField(auto_now_add=True)
-    modified_at = models.DateTimeField(auto_now=True)
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
+    modified_at = models.DateTimeField(auto_now=True, db_index=True)
 
     def __str__(self):
         return self.name
@@ -17,8 +19,8 @@ class Journal(models.Model):
 class Organization(models.Model):
     name = models.CharField(max_length=300, unique=True)
     rank = models.PositiveSmallIntegerField(default=0)
-    created_at = models.DateTimeField(auto_now_add=True)
-    modified_at = models.DateTimeField(auto_now=True)
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
+    modified_at = models.DateTimeField(auto_now=True, db_index=True)
 
     def __str__(self):
         return self.name
@@ -26,12 +28,12 @@ class Organization(models.Model):
 
 class Author(models.Model):
     forename = models.CharField(max_length=100)
-    surname = models.CharField(max_length=100)
+    surname = models.CharField(max_length=100, db_index=True)
     email = models.EmailField(null=True, blank=True, unique=True)
     organization = models.ForeignKey(
         Organization, on_delete=models.PROTECT, null=True, blank=True)
-    created_at = models.DateTimeField(auto_now_add=True)
-    modified_at = models.DateTimeField(auto_now=True)
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
+    modified_at = models.DateTimeField(auto_now=True, db_index=True)
 
     def __str__(self):
         return f'{self.forename} {self.surname}'
@@ -43,6 +45,11 @@ class Author(models.Model):
         ]
 
 
+# Papers `manage.py enrich` still has metadata to look up for
+INCOMPLETE = (models.Q(doi__isnull=True) | models.Q(journal__isnull=True) |
+              models.Q(published_at__isnull=True) | models.Q(url__isnull=True))
+
+
 class Paper(models.Model):
     pdf = models.FileField(upload_to='pdfs/%Y/%m/%d/', blank=True,
                            help_text="Upload *.pdf file and Save to generate .tie.xml using Grobid",
@@ -50,42 +57,79 @@ class Paper(models.Model):
     tei = models.FileField(upload_to='xmls/%Y/%m/%d/', blank=True,
                            help_text="Upload *.tie.xml file and Save to autofill paper data",
                            validators=[FileExtensionValidator(['xml'])])
-    title = models.CharField(max_length=500, null=True,
-                             blank=True, unique=True)
+    title = models.CharField(max_length=500, null=True, blank=True)
     abstract = models.TextField(blank=True)
-    doi = models.CharField(max_length=100, null=True, blank=True, unique=True)
+    doi = models.CharField(max_length=100, null=True, blank=True)
     url = models.URLField(null=True, blank=True, unique=True)
     authors = models.ManyToManyField(Author, blank=True)
     journal = models.ForeignKey(
         Journal, on_delete=models.PROTECT, null=True, blank=True)
-    created_at = models.DateTimeField(auto_now_add=True)
-    modified_at = models.DateTimeField(auto_now=True)
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
+    modified_at = models.DateTimeField(auto_now=True, db_index=True)
     published_at = models.DateField(null=True, blank=True)
+    # Outcome of the last parse/validation, which applies while tei_checked
+    # still names the current TEI file
+    tei_status = models.CharField(max_length=20, blank=True, choices=tei_document.STATUS_CHOICES)
+    tei_checked = models.CharField(max_length=100, blank=True)
 
     def __str__(self):
         return self.title or "<Untitled Paper>"
 
+    class Meta:
+        constraints = [
+            # Titles and DOIs are unique regardless of case; titles are
+            # indexed by hash to keep the index small
+            models.UniqueConstraint(MD5(Lower('title')), name='unique_paper_title'),
+            models.UniqueConstraint(Lower('doi'), name='unique_paper_doi'),
+        ]
+        indexes = [
+            models.Index(fields=('-published_at', 'title'), name='paper_published_idx'),
+            models.Index(fields=('journal', '-published_at', 'title'), name='paper_journal_published_idx'),
+            models.Index(fields=('id',), condition=INCOMPLETE, name='paper_incomplete_idx'),
+        ]
+
+    @profiled('Paper.parse_tei')
     def parse_tei(self):
-        soup = BeautifulSoup(self.tei, 'xml')
-        title_tag = soup.title
-        while not title_tag.getText():
-            title_tag = title_tag.find_next('title')
-        self.title = title_tag.getText()
-        self.abstract = soup.abstract.getText()
-        # self.doi = soup.find('idno', type='DOI').getText()
-        date_published_tag = soup.find('date', type='published')
-        if date_published_tag:
-            self.published_at = parser.parse(date_published_tag.get('when'))
+        try:
+            data = tei_document.parse(self.tei)
+        except tei_document.TEIError as e:
+            self.mark_tei(e.reason)
+            raise
+        except OSError as e:
+            self.mark_tei(tei_document.UNREADABLE)
+            raise tei_document.TEIError(tei_document.UNREADABLE, str(e))
+        self.mark_tei(tei_document.VALID)
+        self.apply_tei(data)
+        self.set_authors(data['authors'])
+        return self
+
+    def mark_tei(self, status):
+        self.tei_status, self.tei_checked = status, self.tei.name
+
+    @property
+    def tei_known_bad(self):
+        return self.tei_checked == self.tei.name and self.tei_status not in ('', tei_document.VALID)
+
+    def apply_tei(self, data):
+        self.title = data['title']
+        self.abstract = data['abstract']
+        if data['doi']:
+            self.doi = data['doi']
+        if data['published_at']:
+            self.published_at = data['published_at']
+        return self
+
+    def set_authors(self, authors_data):
         authors = []
-        for author_tag in soup.find_all('author'):
+        for author_data in authors_data:
             try:
                 organization, created = Organization.objects.get_or_create(
-                    name="; ".join(org.getText() for org in author_tag.find_all('orgName')))
+                    name=author_data['organization'])
                 author, created = Author.objects.update_or_create(
-                    forename=author_tag.forename.getText() if author_tag.forename else None,
-                    surname=author_tag.surname.getText() if author_tag.surname else None,
+                    forename=author_data['forename'],
+                    surname=author_data['surname'],
                     defaults={
-                        'email': author_tag.email.getText() if author_tag.email else None,
+                        'email': author_data['email'],
                         'organization': organization
                     }
                 )
@@ -93,4 +137,113 @@ class Paper(models.Model):
             except IntegrityError:
                 pass
         self.authors.set(authors)
-        return self
+
+
+class Change(models.Model):
+    CREATED = 'C'
+    UPDATED = 'U'
+    DELETED = 'D'
+    ACTION_CHOICES = (
+        (CREATED, 'Created'),
+        (UPDATED, 'Updated'),
+        (DELETED, 'Deleted'),
+    )
+
+    model = models.CharField(max_length=20)
+    object_id = models.BigIntegerField()
+    action = models.CharField(max_length=1, choices=ACTION_CHOICES)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f'{self.get_action_display()} {self.model} {self.object_id}'
+
+    class Meta:
+        ordering = ('id',)
+
+
+class IngestCheckpoint(models.Model):
+    directory = models.CharField(max_length=500, unique=True)
+    key = models.JSONField(default=list)
+    done = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    modified_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return self.directory
+
+
+class MetadataResponse(models.Model):
+    url = models.CharField(max_length=500, unique=True)
+    status = models.PositiveSmallIntegerField()
+    body = models.TextField(blank=True)
+    fetched_at = models.DateTimeField()
+    used_at = models.DateTimeField(db_index=True)
+
+    def __str__(self):
+        return self.url
+
+
+class FacetCount(models.Model):
+    JOURNAL = 'journal'
+    YEAR = 'year'
+    ORGANIZATION = 'organization'
+    FACET_CHOICES = (
+        (JOURNAL, 'Journal'),
+        (YEAR, 'Year'),
+        (ORGANIZATION, 'Organization'),
+    )
+
+    facet = models.CharField(max_length=20, choices=FACET_CHOICES)
+    value = models.BigIntegerField()
+    label = models.CharField(max_length=300)
+    count = models.PositiveIntegerField()
+
+    def __str__(self):
+        return f'{self.get_facet_display()}: {self.label} ({self.count})'
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=('facet', 'value'), name='unique_facet_value'),
+        ]
+        indexes = [
+            models.Index(fields=('facet', '-count'), name='facet_count_idx'),
+        ]
+
+
+class PaperFingerprint(models.Model):
+    """Normalized-title hash and MinHash signature of a paper (see medseer.duplicates)."""
+    paper = models.OneToOneField(Paper, on_delete=models.CASCADE, primary_key=True, related_name='fingerprint')
+    title_key = models.BigIntegerField(null=True, db_index=True)
+    minhash = models.BinaryField()
+
+    def __str__(self):
+        return str(self.paper_id)
+
+
+class PaperBucket(models.Model):
+    """One LSH band of a paper's signature; papers sharing a bucket are duplicate candidates."""
+    paper = models.ForeignKey(Paper, on_delete=models.CASCADE, related_name='+')
+    bucket = models.BigIntegerField(db_index=True)
+
+    def __str__(self):
+        return f'{self.paper_id}: {self.bucket}'
+
+
+class DuplicateCandidate(models.Model):
+    paper = models.ForeignKey(Paper, on_delete=models.CASCADE, related_name='duplicate_candidates')
+    duplicate = models.ForeignKey(Paper, on_delete=models.CASCADE, related_name='+')
+    similarity = models.FloatField()
+    same_title = models.BooleanField(default=False)
+    dismissed = models.BooleanField(default=False)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f'{self.duplicate} ~ {self.paper}'
+
+    class Meta:
+        ordering = ('-similarity',)
+        constraints = [
+            # The older paper is always `paper`, so each pair is stored once
+            models.UniqueConstraint(fields=('paper', 'duplicate'), name='unique_duplicate_candidate'),
+        ]
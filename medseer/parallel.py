@@ -0,0 +1,30 @@
+from collections import deque
+from concurrent.futures import BrokenExecutor
+
+
+def collect(item, future):
+    try:
+        return item, future.result() if future else None, None
+    except BrokenExecutor:
+        # A dead worker (killed, out of memory) says nothing about the item;
+        # callers must stop before it rather than record it as failed
+        raise
+    except Exception as e:
+        return item, None, e
+
+
+def bounded_map(executor, function, items, window):
+    """Yield (item, result, error) in order for (item, argument) pairs, running
+    `function(argument)` on `executor` with at most `window` pending at once.
+
+    `items` is consumed lazily, so it can be a generator over millions of files.
+    A None argument has nothing to run and yields a None result.
+    """
+    in_flight = deque()
+    for item, argument in items:
+        future = executor.submit(function, argument) if argument is not None else None
+        in_flight.append((item, future))
+        if len(in_flight) >= window:
+            yield collect(*in_flight.popleft())
+    while in_flight:
+        yield collect(*in_flight.popleft())
@@ -0,0 +1,155 @@
+import glob
+import json
+import logging
+import os
+import random
+import re
+import time
+from collections import Counter, defaultdict
+from contextlib import ExitStack, contextmanager
+from functools import wraps
+from logging.handlers import RotatingFileHandler
+
+from django.conf import settings
+from django.db import connections
+from django.utils import timezone
+
+_handlers = {}
+
+
+def fingerprint(sql):
+    """Collapse IN lists and whitespace so queries differing only in arity compare equal."""
+    sql = re.sub(r'\((?:%s,\s*)+%s\)', '(...)', sql)
+    return re.sub(r'\s+', ' ', sql).strip()
+
+
+class QueryRecorder:
+    def __init__(self):
+        self.queries = []
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries.append((sql, repr(params), time.perf_counter() - start))
+
+    def summary(self, top=5):
+        executions = Counter((sql, params) for sql, params, duration in self.queries)
+        by_fingerprint = defaultdict(lambda: [0, 0.0])
+        for sql, params, duration in self.queries:
+            stats = by_fingerprint[fingerprint(sql)]
+            stats[0] += 1
+            stats[1] += duration
+        slowest = sorted(by_fingerprint.items(), key=lambda item: item[1][1], reverse=True)[:top]
+        return {
+            'queries': len(self.queries),
+            'query_ms': round(sum(duration for sql, params, duration in self.queries) * 1000, 3),
+            'duplicates': sum(count - 1 for count in executions.values()),
+            'fingerprints': [[sql, count, round(duration * 1000, 3)] for sql, (count, duration) in slowest],
+        }
+
+
+def sampled():
+    rate = settings.PROFILING_SAMPLE_RATE
+    return rate > 0 and (rate >= 1 or random.random() < rate)
+
+
+def logs(path):
+    """Return the per-process logs at `path`, by pid, each with its rotated backup."""
+    found = defaultdict(list)
+    for filename in sorted(glob.glob(f'{glob.escape(path)}.*')):
+        match = re.fullmatch(r'(\d+)(\.1)?', filename[len(path) + 1:])
+        if match:
+            found[match[1]].append(filename)
+    return found
+
+
+def prune(path, keep):
+    """Delete the logs of all but the `keep` most recently written processes."""
+    def modified(filenames):
+        try:
+            return max(os.path.getmtime(filename) for filename in filenames)
+        except FileNotFoundError:
+            return 0
+
+    found = sorted(logs(path).values(), key=modified, reverse=True)
+    for filenames in found[keep:]:
+        for filename in filenames:
+            try:
+                os.remove(filename)
+            except FileNotFoundError:
+                pass
+
+
+def write(record):
+    # Rotation isn't safe across processes, so each gunicorn worker and
+    # management command writes (and rotates) a file of its own; the files
+    # of exited processes are pruned as new ones start
+    path = f'{settings.PROFILING_LOG}.{os.getpid()}'
+    if path not in _handlers:
+        prune(settings.PROFILING_LOG, settings.PROFILING_LOG_MAX_FILES - 1)
+        _handlers[path] = RotatingFileHandler(
+            path, maxBytes=settings.PROFILING_LOG_MAX_BYTES, backupCount=1, delay=True)
+    _handlers[path].handle(logging.makeLogRecord({'msg': json.dumps(record)}))
+
+
+@contextmanager
+def profile(name):
+    """Record wall/CPU time and queries of the block to the profiling log, when sampled.
+
+    Yields the record so callers can rename it once the operation is known.
+    """
+    if not sampled():
+        yield {}
+        return
+    record = {'name': name, 'at': timezone.now().isoformat()}
+    recorder = QueryRecorder()
+    wall, cpu = time.perf_counter(), time.process_time()
+    try:
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(recorder))
+            yield record
+    finally:
+        record['wall_ms'] = round((time.perf_counter() - wall) * 1000, 3)
+        record['cpu_ms'] = round((time.process_time() - cpu) * 1000, 3)
+        record.update(recorder.summary())
+        write(record)
+
+
+def profiled(name):
+    def decorator(function):
+        @wraps(function)
+        def wrapper(*args, **kwargs):
+            with profile(name):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+class ProfilingMiddleware:
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        with profile(f'{request.method} {request.path}') as record:
+            response = self.get_response(request)
+            if record and request.resolver_match:
+                record['name'] = f'{request.method} {request.resolver_match.view_name}'
+            return response
+
+
+def read_log(path):
+    """Yield the records of every process's log at `path`, skipping partly written lines."""
+    for filenames in logs(path).values():
+        for filename in filenames:
+            try:
+                with open(filename) as f:
+                    for line in f:
+                        try:
+                            yield json.loads(line)
+                        except json.JSONDecodeError:
+                            continue
+            except FileNotFoundError:
+                pass
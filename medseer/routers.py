@@ -0,0 +1,83 @@
+import random
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS
+
+PIN_COOKIE = 'medseer_primary'
+
+# Database read-only code is sent to (see read_only), and whether reads
+# must stay on the primary: True after a write, PIN_COOKIE after one in
+# the same session
+_reads = ContextVar('medseer_reads', default=None)
+_pinned = ContextVar('medseer_pinned', default=False)
+
+
+def pinned():
+    """Whether reads must see this request's or session's own writes."""
+    return bool(_pinned.get())
+
+
+def replica():
+    """Database to serve a read-only operation from, given the current stickiness."""
+    if pinned() or not settings.DATABASE_REPLICAS:
+        return DEFAULT_DB_ALIAS
+    return random.choice(settings.DATABASE_REPLICAS)
+
+
+@contextmanager
+def read_only(database=None):
+    """Route reads in the block (or decorated view) to `database`, a replica by default.
+
+    Everything else reads from the primary, so ingestion, signals and the
+    admin never see replication lag.
+    """
+    token = _reads.set(database or replica())
+    try:
+        yield
+    finally:
+        _reads.reset(token)
+
+
+class ReplicaRouter:
+    def db_for_read(self, model, **hints):
+        return _reads.get()
+
+    def db_for_write(self, model, **hints):
+        # Saving the session happens on every request and changes nothing read from replicas
+        if model._meta.app_label != 'sessions':
+            _pinned.set(True)
+            if _reads.get():
+                _reads.set(DEFAULT_DB_ALIAS)
+        return DEFAULT_DB_ALIAS
+
+    def allow_migrate(self, db, app_label, **hints):
+        # Replicas receive the schema from the primary
+        if db in settings.DATABASE_REPLICAS:
+            return False
+        return None
+
+    def allow_relation(self, obj1, obj2, **hints):
+        databases = {DEFAULT_DB_ALIAS, *settings.DATABASE_REPLICAS}
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
+
+
+class ReplicaMiddleware:
+    """Keeps a session's reads on the primary for REPLICA_PIN_SECONDS after it writes."""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        token = _pinned.set(PIN_COOKIE in request.COOKIES and PIN_COOKIE)
+        try:
+            response = self.get_response(request)
+            if _pinned.get() is True:
+                response.set_cookie(PIN_COOKIE, '1', max_age=settings.REPLICA_PIN_SECONDS,
+                                    httponly=True, samesite='Lax')
+            return response
+        finally:
+            _pinned.reset(token)
@@ -0,0 +1,117 @@
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete, pre_save
+from django.dispatch import receiver
+
+from . import duplicates, facets
+from .models import Author, Change, FacetCount, Journal, Organization, Paper
+
+TRACKED_MODELS = (Journal, Organization, Author, Paper)
+
+
+def record_change(sender, instance, created=None, **kwargs):
+    if kwargs.get('raw'):
+        return
+    if created is None:
+        action = Change.DELETED
+    else:
+        action = Change.CREATED if created else Change.UPDATED
+    Change.objects.create(model=sender._meta.model_name,
+                          object_id=instance.pk, action=action)
+
+
+for model in TRACKED_MODELS:
+    post_save.connect(record_change, sender=model,
+                      dispatch_uid=f'medseer_change_save_{model._meta.model_name}')
+    post_delete.connect(record_change, sender=model,
+                        dispatch_uid=f'medseer_change_delete_{model._meta.model_name}')
+
+
+@receiver(m2m_changed, sender=Paper.authors.through, dispatch_uid='medseer_change_paper_authors')
+def record_authors_change(sender, instance, action, reverse, pk_set, **kwargs):
+    if action == 'pre_clear' and reverse:
+        # The affected papers are unknown once the relation is cleared
+        pk_set = set(instance.paper_set.values_list('pk', flat=True))
+        instance._cleared_paper_ids = pk_set
+        return
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    if not reverse:
+        paper_ids = [instance.pk]
+    elif action == 'post_clear':
+        paper_ids = getattr(instance, '_cleared_paper_ids', ())
+    else:
+        paper_ids = pk_set or ()
+    Change.objects.bulk_create(
+        Change(model=Paper._meta.model_name, object_id=paper_id, action=Change.UPDATED)
+        for paper_id in paper_ids)
+
+
+@receiver(pre_save, sender=Paper, dispatch_uid='medseer_facets_paper_pre_save')
+@receiver(pre_delete, sender=Paper, dispatch_uid='medseer_facets_paper_pre_delete')
+def remember_paper_facets(sender, instance, **kwargs):
+    if not kwargs.get('raw'):
+        instance._facet_memberships = facets.memberships([instance.pk]) if instance.pk else {}
+
+
+@receiver(post_save, sender=Paper, dispatch_uid='medseer_facets_paper_save')
+@receiver(post_delete, sender=Paper, dispatch_uid='medseer_facets_paper_delete')
+def count_paper_facets(sender, instance, created=None, **kwargs):
+    if kwargs.get('raw'):
+        return
+    before = getattr(instance, '_facet_memberships', {})
+    facets.apply(before, {} if created is None else facets.memberships([instance.pk]))
+    facets.bump()
+
+
+@receiver(m2m_changed, sender=Paper.authors.through, dispatch_uid='medseer_facets_paper_authors')
+def count_author_facets(sender, instance, action, reverse, pk_set, **kwargs):
+    if action.startswith('pre_'):
+        if not reverse:
+            paper_ids = [instance.pk]
+        elif action == 'pre_clear':
+            paper_ids = list(instance.paper_set.values_list('pk', flat=True))
+        else:
+            paper_ids = list(pk_set or ())
+        instance._facet_papers = paper_ids
+        instance._facet_memberships = facets.memberships(paper_ids)
+    else:
+        facets.apply(getattr(instance, '_facet_memberships', {}),
+                     facets.memberships(getattr(instance, '_facet_papers', ())))
+
+
+@receiver(pre_save, sender=Author, dispatch_uid='medseer_facets_author_pre_save')
+@receiver(pre_delete, sender=Author, dispatch_uid='medseer_facets_author_pre_delete')
+def remember_author_papers(sender, instance, **kwargs):
+    if instance.pk and not kwargs.get('raw'):
+        instance._facet_papers = list(Paper.objects.filter(authors=instance.pk).values_list('pk', flat=True))
+        instance._facet_memberships = facets.memberships(instance._facet_papers)
+
+
+@receiver(post_save, sender=Author, dispatch_uid='medseer_facets_author_save')
+@receiver(post_delete, sender=Author, dispatch_uid='medseer_facets_author_delete')
+def count_author_papers(sender, instance, created=None, **kwargs):
+    if kwargs.get('raw') or created:
+        return
+    facets.apply(getattr(instance, '_facet_memberships', {}),
+                 facets.memberships(getattr(instance, '_facet_papers', ())))
+
+
+@receiver(post_delete, sender=Author, dispatch_uid='medseer_change_author_papers')
+def record_author_papers_change(sender, instance, **kwargs):
+    # The cascade removes the author from its papers without m2m_changed
+    Change.objects.bulk_create(
+        Change(model=Paper._meta.model_name, object_id=paper_id, action=Change.UPDATED)
+        for paper_id in getattr(instance, '_facet_papers', ()))
+
+
+@receiver(post_save, sender=Journal, dispatch_uid='medseer_facets_journal_label')
+@receiver(post_save, sender=Organization, dispatch_uid='medseer_facets_organization_label')
+def relabel_facet(sender, instance, created, **kwargs):
+    if not created and not kwargs.get('raw'):
+        if FacetCount.objects.filter(facet=sender._meta.model_name, value=instance.pk).update(label=instance.name):
+            facets.bump()
+
+
+@receiver(post_save, sender=Paper, dispatch_uid='medseer_duplicates_paper_save')
+def index_paper(sender, instance, **kwargs):
+    if not kwargs.get('raw'):
+        duplicates.index([instance])
@@ -0,0 +1,81 @@
+from collections import defaultdict
+from datetime import timedelta
+
+from django.conf import settings
+from django.db.models import Min
+from django.utils import timezone
+
+from .models import Author, Change, Journal, Organization, Paper
+
+MODELS = {model._meta.model_name: model
+          for model in (Journal, Organization, Author, Paper)}
+
+
+def latest_cursor(since=0, limit=None):
+    """Return the cursor a consumer reaches after reading `limit` changes past `since`.
+
+    Ids are handed out on insert but become visible on commit, so a change
+    recorded just now may be followed by a lower id still in an open
+    transaction (an ingest batch, say). Changes younger than
+    SYNC_SETTLE_SECONDS, and all after them, are held back until they settle;
+    the setting must exceed the longest transaction that records changes.
+    Replication lag would add to that window unpredictably, so changes are
+    only ever read from the primary.
+    """
+    ids = Change.objects.filter(id__gt=since).values_list('id', flat=True)
+    cursor = None
+    if limit is not None:
+        cursor = ids.order_by('id')[limit - 1:limit].first()
+    if cursor is None:
+        cursor = ids.order_by('-id').first() or since
+    settled = timezone.now() - timedelta(seconds=settings.SYNC_SETTLE_SECONDS)
+    recent = Change.objects.filter(id__gt=since, id__lte=cursor, created_at__gt=settled).aggregate(Min('id'))
+    if recent['id__min'] is not None:
+        # Not recent['id__min'] - 1, which may be the id still in flight
+        return ids.filter(id__lt=recent['id__min']).order_by('-id').first() or since
+    return cursor
+
+
+def snapshot(model_name, ids):
+    """Fetch the current state of the given objects with one query per model."""
+    model = MODELS[model_name]
+    rows = {row['id']: row for row in model.objects.filter(pk__in=ids).values()}
+    if model is Paper:
+        for row in rows.values():
+            row['authors'] = []
+        links = Paper.authors.through.objects.filter(paper_id__in=rows).order_by('id')
+        for paper_id, author_id in links.values_list('paper_id', 'author_id'):
+            rows[paper_id]['authors'].append(author_id)
+    return rows
+
+
+def iter_changes(since=0, until=None, batch_size=1000):
+    """Yield changes after `since` (up to `until`) in id order, reading in batches.
+
+    Each change carries the current state of its object, or None once deleted.
+    """
+    cursor = since
+    while True:
+        changes = Change.objects.filter(id__gt=cursor)
+        if until is not None:
+            changes = changes.filter(id__lte=until)
+        batch = list(changes.order_by('id')[:batch_size])
+        if not batch:
+            return
+        pending = defaultdict(set)
+        for change in batch:
+            if change.action != Change.DELETED:
+                pending[change.model].add(change.object_id)
+        states = {name: snapshot(name, ids) for name, ids in pending.items()}
+        for change in batch:
+            yield {
+                'cursor': change.id,
+                'model': change.model,
+                'id': change.object_id,
+                'action': change.get_action_display().lower(),
+                'at': change.created_at,
+                'data': states.get(change.model, {}).get(change.object_id),
+            }
+        cursor = batch[-1].id
+        if len(batch) < batch_size or cursor == until:
+            return
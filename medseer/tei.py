@@ -0,0 +1,122 @@
+VALID = 'valid'
+UNREADABLE = 'unreadable'
+MALFORMED = 'malformed'
+MISSING_TITLE = 'missing_title'
+MISSING_ABSTRACT = 'missing_abstract'
+BAD_DATE = 'bad_date'
+STATUS_CHOICES = (
+    (VALID, 'Valid'),
+    (UNREADABLE, 'Unreadable file'),
+    (MALFORMED, 'Malformed XML'),
+    (MISSING_TITLE, 'Missing title'),
+    (MISSING_ABSTRACT, 'Missing abstract'),
+    (BAD_DATE, 'Bad publication date'),
+)
+
+
+class TEIError(ValueError):
+    """A TEI document paper data can't be extracted from; `reason` is one of STATUS_CHOICES."""
+
+    def __init__(self, reason, message=''):
+        super().__init__(f'{reason}: {message}' if message else reason)
+        self.reason = reason
+
+
+def parse_date(when):
+    from dateutil import parser
+
+    try:
+        return parser.parse(when).date()
+    except (TypeError, ValueError, OverflowError) as e:
+        raise TEIError(BAD_DATE, f'{when!r} ({e})')
+
+
+def parse(tei):
+    """Extract paper data from a TEI document without touching the database."""
+    # Imported here so that loading the models (every manage.py run and
+    # worker boot) doesn't pay for the XML parser stack
+    from bs4 import BeautifulSoup
+
+    soup = BeautifulSoup(tei, 'xml')
+    title = next((tag.getText() for tag in soup.find_all('title') if tag.getText()), None)
+    if title is None:
+        raise TEIError(MISSING_TITLE)
+    if soup.abstract is None:
+        raise TEIError(MISSING_ABSTRACT)
+    data = {
+        'title': title,
+        'abstract': soup.abstract.getText(),
+        'doi': None,
+        'published_at': None,
+        'authors': [],
+    }
+    doi_tag = soup.find('idno', type='DOI')
+    if doi_tag and doi_tag.getText().strip():
+        data['doi'] = doi_tag.getText().strip()
+    date_published_tag = soup.find('date', type='published')
+    if date_published_tag:
+        data['published_at'] = parse_date(date_published_tag.get('when'))
+    for author_tag in soup.find_all('author'):
+        data['authors'].append({
+            'forename': author_tag.forename.getText() if author_tag.forename else None,
+            'surname': author_tag.surname.getText() if author_tag.surname else None,
+            'email': author_tag.email.getText() if author_tag.email else None,
+            'organization': "; ".join(org.getText() for org in author_tag.find_all('orgName')),
+        })
+    return data
+
+
+def read(path):
+    """Parse the TEI file at `path`; runs in ingestion worker processes."""
+    with open(path, 'rb') as tei:
+        return parse(tei)
+
+
+def validate(path):
+    """Check the TEI file at `path` for what parse() needs, streaming it in constant memory.
+
+    Like parse() (BeautifulSoup's 'xml' mode is lxml in recover mode), this
+    tolerates recoverable errors such as a bare '&', so a file is only
+    reported MALFORMED when no XML can be read from it at all.
+    Returns (status, message); runs in validation worker processes.
+    """
+    from lxml import etree
+
+    title = abstract = published = root = False
+    when, depth = None, 0
+    try:
+        for event, element in etree.iterparse(path, events=('start', 'end'), recover=True):
+            if event == 'start':
+                depth += 1
+                root = True
+                continue
+            depth -= 1
+            name = etree.QName(element).localname
+            if name == 'title' and not title and ''.join(element.itertext()):
+                title = True
+            elif name == 'abstract':
+                abstract = True
+            elif name == 'date' and not published and element.get('type') == 'published':
+                published, when = True, element.get('when')
+            # Free each top-level section (header parts, body divisions) once
+            # read, so memory is bounded by the largest one, not the file
+            if depth <= 3:
+                element.clear()
+                while element.getprevious() is not None:
+                    del element.getparent()[0]
+    except etree.XMLSyntaxError as e:
+        return MALFORMED, str(e)
+    except OSError as e:
+        return UNREADABLE, str(e)
+    if not root:
+        return MALFORMED, 'no XML elements found'
+    try:
+        if not title:
+            raise TEIError(MISSING_TITLE)
+        if not abstract:
+            raise TEIError(MISSING_ABSTRACT)
+        if published:
+            parse_date(when)
+    except TEIError as e:
+        return e.reason, str(e)
+    return VALID, ''
@@ -1,3 +1,803 @@
-from django.test import TestCase
+import asyncio
+import hashlib
+import json
+import os
+import re
+import tempfile
+import threading
+import time
+from concurrent.futures import Future
+from concurrent.futures.process import BrokenProcessPool
+from datetime import date, datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from io import StringIO
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth.models import User
+from django.core.files.base import ContentFile
+from django.core.cache import cache
+from django.core.management import CommandError, call_command
+from django.db import DataError, IntegrityError, connection, router, transaction
+from django.db.models.functions import MD5, Lower
+from django.test import TestCase, override_settings
+
+from . import duplicates, facets
+from .enrichment import CrossrefSource, RateLimiter, cached_fetch
+from .management.commands.ingest import walk
+from .models import (INCOMPLETE, Author, Change, DuplicateCandidate, FacetCount, IngestCheckpoint, Journal,
+                     MetadataResponse, Organization, Paper, PaperBucket, PaperFingerprint)
+from .profiling import fingerprint, read_log
+from .routers import PIN_COOKIE, _pinned, read_only
+from .tei import BAD_DATE, MALFORMED, MISSING_ABSTRACT, MISSING_TITLE, UNREADABLE, VALID, validate
+
+TEI = '''<?xml version="1.0" encoding="UTF-8"?>
+<TEI xmlns="http://www.tei-c.org/ns/1.0">
+  <teiHeader>
+    <fileDesc>
+      <titleStmt><title level="a" type="main">{title}</title></titleStmt>
+      <publicationStmt><date type="published" when="2021-03-04">4 March 2021</date></publicationStmt>
+      <sourceDesc><biblStruct><analytic>
+        <author><persName><forename type="first">Ada</forename><surname>Lovelace</surname></persName>
+          <affiliation><orgName type="institution">Babbage Lab</orgName></affiliation></author>
+      </analytic><idno type="DOI">{doi}</idno></biblStruct></sourceDesc>
+    </fileDesc>
+    <profileDesc><abstract><p>Notes on the engine.</p></abstract></profileDesc>
+  </teiHeader>
+</TEI>
+'''
+
+
+class FakeMetadataHandler(BaseHTTPRequestHandler):
+    works = {}
+    requests = []
+
+    def do_GET(self):
+        self.requests.append((time.monotonic(), self.path))
+        doi = self.path[len('/works/'):]
+        if doi not in self.works:
+            self.send_error(404)
+            return
+        body = json.dumps({'message': self.works[doi]}).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def write_corpus(root, files):
+    for name, content in files.items():
+        path = os.path.join(root, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'w') as f:
+            f.write(content)
+
+
+@override_settings(SYNC_SETTLE_SECONDS=0)
+class ChangeFeedTests(TestCase):
+    def setUp(self):
+        self.journal = Journal.objects.create(name='The Lancet')
+        self.author = Author.objects.create(forename='Ada', surname='Lovelace')
+        self.paper = Paper.objects.create(title='On Engines', journal=self.journal)
+        self.client.force_login(User.objects.create_superuser('admin', 'admin@example.com', 'secret'))
+
+    def changes(self):
+        return list(Change.objects.values_list('model', 'object_id', 'action'))
+
+    def sync(self, **params):
+        response = self.client.get('/api/sync/', params)
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        return response, [json.loads(line) for line in lines]
+
+    def test_save_and_delete_are_recorded(self):
+        self.paper.title = 'On Analytical Engines'
+        self.paper.save()
+        organization = Organization.objects.create(name='Babbage Lab')
+        organization_id = organization.pk
+        organization.delete()
+        self.assertEqual(self.changes(), [
+            ('journal', self.journal.pk, Change.CREATED),
+            ('author', self.author.pk, Change.CREATED),
+            ('paper', self.paper.pk, Change.CREATED),
+            ('paper', self.paper.pk, Change.UPDATED),
+            ('organization', organization_id, Change.CREATED),
+            ('organization', organization_id, Change.DELETED),
+        ])
+
+    def test_author_changes_are_recorded_on_paper(self):
+        Change.objects.all().delete()
+        self.paper.authors.add(self.author)
+        self.author.paper_set.clear()
+        self.assertEqual(self.changes(), [
+            ('paper', self.paper.pk, Change.UPDATED),
+            ('paper', self.paper.pk, Change.UPDATED),
+        ])
+
+    def test_deleting_an_author_is_recorded_on_its_papers(self):
+        self.paper.authors.add(self.author)
+        author_id = self.author.pk
+        Change.objects.all().delete()
+        self.author.delete()
+        self.assertEqual(self.changes(), [
+            ('author', author_id, Change.DELETED),
+            ('paper', self.paper.pk, Change.UPDATED),
+        ])
+
+    def test_sync_streams_changes_after_cursor(self):
+        self.paper.authors.add(self.author)
+        response, changes = self.sync(since=0, limit=3)
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        self.assertEqual([change['model'] for change in changes], ['journal', 'author', 'paper'])
+        self.assertEqual(changes[2]['data']['authors'], [self.author.pk])
+        self.assertEqual(changes[2]['data']['journal_id'], self.journal.pk)
+
+        cursor = response['X-Sync-Cursor']
+        self.assertEqual(int(cursor), changes[-1]['cursor'])
+        self.paper.delete()
+        response, changes = self.sync(since=cursor)
+        self.assertEqual([(change['action'], change['data']) for change in changes],
+                         [('updated', None), ('deleted', None)])
+
+        response, changes = self.sync(since=response['X-Sync-Cursor'])
+        self.assertEqual(changes, [])
+
+    @override_settings(SYNC_SETTLE_SECONDS=60)
+    def test_sync_holds_back_changes_until_lower_ids_commit(self):
+        settled = datetime.now(timezone.utc) - timedelta(minutes=2)
+        Change.objects.update(created_at=settled)
+        cursor = Change.objects.last().id
+        # An admin edit commits while an ingest batch holding the id before it is still open
+        Change.objects.create(id=cursor + 2, model='paper', object_id=self.paper.pk, action=Change.UPDATED)
+        response, changes = self.sync(since=cursor - 1)
+        self.assertEqual([change['cursor'] for change in changes], [cursor])
+        self.assertEqual(int(response['X-Sync-Cursor']), cursor)
+
+        Change.objects.create(id=cursor + 1, model='journal', object_id=self.journal.pk, action=Change.UPDATED)
+        Change.objects.update(created_at=settled)
+        response, changes = self.sync(since=cursor)
+        self.assertEqual([change['cursor'] for change in changes], [cursor + 1, cursor + 2])
+
+    def test_sync_requires_staff(self):
+        self.client.logout()
+        self.assertEqual(self.client.get('/api/sync/').status_code, 403)
+        self.client.force_login(User.objects.create_user('reader', 'reader@example.com', 'secret'))
+        self.assertEqual(self.client.get('/api/sync/').status_code, 403)
+
+    def test_sync_rejects_bad_cursor(self):
+        self.assertEqual(self.client.get('/api/sync/', {'since': 'x'}).status_code, 400)
+        self.assertEqual(self.client.get('/api/sync/', {'limit': 0}).status_code, 400)
+
+    def test_changes_command_reads_in_batches(self):
+        out, err = StringIO(), StringIO()
+        with self.assertNumQueries(7):
+            call_command('changes', since=1, batch_size=1, stdout=out, stderr=err)
+        changes = [json.loads(line) for line in out.getvalue().splitlines()]
+        self.assertEqual([change['model'] for change in changes], ['author', 'paper'])
+        self.assertEqual(err.getvalue().strip(), f'cursor: {changes[-1]["cursor"]}')
+
+
+class IngestTests(TestCase):
+    def setUp(self):
+        self.corpus = tempfile.TemporaryDirectory()
+        self.media = tempfile.TemporaryDirectory()
+        self.addCleanup(self.corpus.cleanup)
+        self.addCleanup(self.media.cleanup)
+        write_corpus(self.corpus.name, {
+            'a/one.tei.xml': TEI.format(doi='', title='One'),
+            'a/one.pdf': '%PDF-1.4',
+            'a/notes.txt': 'ignored',
+            'a-b/two.tei.xml': TEI.format(doi='', title='Two'),
+            'b/broken.tei.xml': '<TEI/>',
+            'b/c/three.xml': TEI.format(doi='', title='Three'),
+            'zero.tei.xml': TEI.format(doi='', title='Zero'),
+        })
+
+    def ingest(self, **options):
+        out, err = StringIO(), StringIO()
+        with override_settings(MEDIA_ROOT=self.media.name):
+            call_command('ingest', self.corpus.name, jobs=1, batch_size=2, stdout=out, stderr=err, **options)
+        return out.getvalue(), err.getvalue()
+
+    def test_walk_groups_files_and_resumes_after_checkpoint(self):
+        papers = list(walk(self.corpus.name))
+        names = [[name for kind, name in key] for key, files in papers]
+        self.assertEqual(names, [['zero'], ['a', 'one'], ['a-b', 'two'], ['b', 'broken'], ['b', 'c', 'three']])
+        self.assertEqual(sorted(papers[1][1]), ['pdf', 'tei'])
+        resumed = [key for key, files in walk(self.corpus.name, papers[3][0])]
+        self.assertEqual(resumed, [papers[4][0]])
+
+    def test_ingest_creates_papers_and_checkpoints(self):
+        out, err = self.ingest(count=True)
+        self.assertEqual(sorted(Paper.objects.values_list('title', flat=True)), ['One', 'Three', 'Two', 'Zero'])
+        paper = Paper.objects.get(title='One')
+        self.assertTrue(paper.pdf.name.endswith('one.pdf'))
+        self.assertEqual(str(paper.published_at), '2021-03-04')
+        self.assertEqual([str(author) for author in paper.authors.all()], ['Ada Lovelace'])
+        self.assertIn('broken.tei.xml', err)
+        self.assertIn('ETA', out)
+        self.assertIn('4 created, 0 skipped, 1 failed', out)
+        self.assertEqual(IngestCheckpoint.objects.get().done, 5)
+        self.assertEqual(paper.tei_status, VALID)
+        self.assertFalse(paper.tei_known_bad)
+
+        write_corpus(self.corpus.name, {'c/four.tei.xml': TEI.format(doi='', title='Four')})
+        out, err = self.ingest()
+        self.assertIn('Resuming after 5 papers', out)
+        self.assertIn('Ingested 1 papers: 1 created', out)
+
+        out, err = self.ingest(restart=True)
+        self.assertIn('0 created, 5 skipped, 1 failed', out)
+        self.assertEqual(Paper.objects.count(), 5)
+
+    def test_papers_that_cant_be_stored_fail_without_stopping_the_ingest(self):
+        write_corpus(self.corpus.name, {'c/five.tei.xml': TEI.format(doi='', title='Five'), 'c/five.pdf': '%PDF'})
+        set_authors = Paper.set_authors
+
+        def vanishing(path, *args):
+            if path.endswith('five.pdf'):
+                raise FileNotFoundError(path)
+            return open(path, *args)
+
+        def long_names(paper, authors):
+            if paper.title == 'Two':
+                raise DataError('value too long for type character varying(100)')
+            set_authors(paper, authors)
+
+        with mock.patch.object(Paper, 'set_authors', long_names), \
+                mock.patch('medseer.management.commands.ingest.open', vanishing, create=True):
+            out, err = self.ingest()
+        self.assertIn('3 created, 0 skipped, 3 failed', out)
+        self.assertIn('DataError', err)
+        self.assertIn('FileNotFoundError', err)
+        self.assertEqual(IngestCheckpoint.objects.get().done, 6)
+        self.assertEqual(sorted(Paper.objects.values_list('title', flat=True)), ['One', 'Three', 'Zero'])
+        stored = [name for root, dirs, names in os.walk(self.media.name) for name in names]
+        self.assertFalse([name for name in stored if name.startswith(('two', 'five'))])
+
+    def test_dead_parser_leaves_checkpoint_before_in_flight_papers(self):
+        with mock.patch('medseer.management.commands.ingest.ProcessPoolExecutor', DyingExecutor('two.tei.xml')):
+            with self.assertRaisesMessage(CommandError, 'resume after 2 papers'):
+                self.ingest()
+        self.assertEqual(IngestCheckpoint.objects.get().done, 2)
+        self.assertEqual(Paper.objects.count(), 2)
+
+        out, err = self.ingest()
+        self.assertIn('Resuming after 2 papers', out)
+        self.assertIn('3 papers: 2 created, 0 skipped, 1 failed', out)
+
+
+class DyingExecutor:
+    """Runs tasks inline, except that the worker parsing `fatal` dies."""
+
+    def __init__(self, fatal):
+        self.fatal = fatal
+
+    def __call__(self, *args, **kwargs):
+        return self
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        pass
+
+    def submit(self, function, path):
+        future = Future()
+        try:
+            if path.endswith(self.fatal):
+                raise BrokenProcessPool('worker died')
+            future.set_result(function(path))
+        except Exception as e:
+            future.set_exception(e)
+        return future
+
+
+class TEIValidationTests(TestCase):
+    files = {
+        'valid.tei.xml': TEI.format(doi='', title='Valid'),
+        'malformed.tei.xml': '%PDF-1.4 not a TEI document',
+        # parse() recovers from a bare '&', so the validator must too
+        'recoverable.tei.xml': TEI.format(doi='', title='Heart & Lung outcomes'),
+        'untitled.tei.xml': TEI.format(doi='', title=''),
+        'no-abstract.tei.xml': re.sub('<profileDesc>.*</profileDesc>', '', TEI.format(doi='', title='Short')),
+        'bad-date.tei.xml': TEI.format(doi='', title='Dated').replace('2021-03-04', 'someday'),
+    }
+
+    def setUp(self):
+        self.media = tempfile.TemporaryDirectory()
+        self.addCleanup(self.media.cleanup)
+        settings = override_settings(MEDIA_ROOT=self.media.name)
+        settings.enable()
+        self.addCleanup(settings.disable)
+        self.papers = {}
+        for name, content in self.files.items():
+            paper = Paper(url=f'https://example.com/{name}')
+            paper.tei.save(name, ContentFile(content))
+            self.papers[name] = paper
+
+    def test_validate_classifies_failures(self):
+        statuses = {name: validate(paper.tei.path)[0] for name, paper in self.papers.items()}
+        self.assertEqual(statuses, {
+            'valid.tei.xml': VALID,
+            'malformed.tei.xml': MALFORMED,
+            'recoverable.tei.xml': VALID,
+            'untitled.tei.xml': MISSING_TITLE,
+            'no-abstract.tei.xml': MISSING_ABSTRACT,
+            'bad-date.tei.xml': BAD_DATE,
+        })
+        self.assertEqual(validate(os.path.join(self.media.name, 'missing.tei.xml'))[0], UNREADABLE)
+
+    def test_command_marks_papers_and_reports(self):
+        report = os.path.join(self.media.name, 'report.json')
+        out = StringIO()
+        call_command('validate_tei', jobs=1, batch_size=2, report=report, stdout=out)
+        self.assertIn('Checked 6 TEI files: 2 valid, 4 invalid', out.getvalue())
+        self.assertEqual(dict(Paper.objects.values_list('url', 'tei_status'))['https://example.com/bad-date.tei.xml'],
+                         BAD_DATE)
+        with open(report) as f:
+            failures = json.load(f)['failures']
+        self.assertEqual(sorted(failures), [BAD_DATE, MALFORMED, MISSING_ABSTRACT, MISSING_TITLE])
+        self.assertEqual(failures[MISSING_TITLE][0][0], self.papers['untitled.tei.xml'].pk)
+
+        out = StringIO()
+        call_command('validate_tei', jobs=1, stdout=out)
+        self.assertIn('Checked 0 TEI files', out.getvalue())
+
+    def test_admin_action_skips_known_bad_files(self):
+        call_command('validate_tei', jobs=1, stdout=StringIO())
+        Paper.objects.filter(pk=self.papers['untitled.tei.xml'].pk).update(tei_status='', tei_checked='')
+        self.client.force_login(User.objects.create_superuser('admin', 'admin@example.com', 'secret'))
+        response = self.client.post('/admin/medseer/paper/', {
+            'action': 'parse_tei',
+            '_selected_action': [paper.pk for paper in self.papers.values()],
+        }, follow=True)
+        messages = [str(message) for message in response.context['messages']]
+        self.assertIn('Parsed 2 papers, skipped 3 with known-bad TEI', messages)
+        self.assertIn('Could not parse 1 TEI files', messages[1])
+        self.assertEqual(Paper.objects.get(pk=self.papers['valid.tei.xml'].pk).title, 'Valid')
+        self.assertEqual(Paper.objects.get(pk=self.papers['recoverable.tei.xml'].pk).title, 'Heart  Lung outcomes')
+        self.assertEqual(Paper.objects.get(pk=self.papers['untitled.tei.xml'].pk).tei_status, MISSING_TITLE)
+
+    def test_admin_action_reports_papers_clashing_with_others(self):
+        Paper.objects.create(title='Published', doi='10.1000/taken')
+        clash = Paper(url='https://example.com/clash')
+        clash.tei.save('clash.tei.xml', ContentFile(TEI.format(doi='10.1000/TAKEN', title='Preprint')))
+        self.client.force_login(User.objects.create_superuser('admin', 'admin@example.com', 'secret'))
+        response = self.client.post('/admin/medseer/paper/', {
+            'action': 'parse_tei',
+            '_selected_action': [clash.pk, self.papers['valid.tei.xml'].pk],
+        }, follow=True)
+        messages = [str(message) for message in response.context['messages']]
+        self.assertIn('Parsed 1 papers, skipped 0 with known-bad TEI', messages)
+        self.assertIn('clash.tei.xml', messages[1])
+        clash.refresh_from_db()
+        self.assertEqual((clash.title, clash.authors.count()), (None, 0))
+
+        response = self.client.get(f'/admin/medseer/paper/{clash.pk}/parse_tei/', follow=True)
+        self.assertContains(response, 'Could not parse TEI')
+
+
+class ProfilingTests(TestCase):
+    def setUp(self):
+        self.media = tempfile.TemporaryDirectory()
+        self.addCleanup(self.media.cleanup)
+        self.log = os.path.join(self.media.name, 'profiling.log')
+        settings = override_settings(MEDIA_ROOT=self.media.name, PROFILING_LOG=self.log, PROFILING_SAMPLE_RATE=1)
+        settings.enable()
+        self.addCleanup(settings.disable)
+        self.paper = Paper()
+        self.paper.tei.save('paper.tei.xml', ContentFile(TEI.format(doi='', title='Profiled')))
+
+    def test_fingerprint_collapses_in_lists(self):
+        self.assertEqual(fingerprint('SELECT 1 FROM t\n WHERE id IN (%s, %s, %s)'),
+                         'SELECT 1 FROM t WHERE id IN (...)')
+
+    def test_parse_tei_and_admin_views_are_profiled(self):
+        self.paper.parse_tei().save()
+        self.client.force_login(User.objects.create_superuser('admin', 'admin@example.com', 'secret'))
+        self.client.get('/admin/medseer/paper/')
+        records = {record['name']: record for record in read_log(self.log)}
+        self.assertIn('GET admin:medseer_paper_changelist', records)
+        parse = records['Paper.parse_tei']
+        self.assertGreater(parse['queries'], 0)
+        self.assertGreaterEqual(parse['wall_ms'], parse['query_ms'])
+
+        out = StringIO()
+        call_command('profile_report', top=1, name='parse_tei', stdout=out)
+        self.assertIn('Paper.parse_tei', out.getvalue())
+        self.assertIn('medseer_organization', out.getvalue())
+
+    def test_sampling_disabled(self):
+        with override_settings(PROFILING_SAMPLE_RATE=0):
+            self.paper.parse_tei()
+        self.assertEqual(list(read_log(self.log)), [])
+
+    def test_log_is_read_across_processes_skipping_torn_lines(self):
+        self.paper.parse_tei()
+        with open(f'{self.log}.1', 'w') as f:
+            f.write(json.dumps({'name': 'other worker'}) + '\n{"name": "cut sho')
+        with open(f'{self.log}.backup', 'w') as f:
+            f.write('not a log\n')
+        names = [record['name'] for record in read_log(self.log)]
+        self.assertEqual(sorted(names), ['Paper.parse_tei', 'other worker'])
+
+    @override_settings(PROFILING_LOG_MAX_FILES=2)
+    def test_logs_of_exited_processes_are_pruned(self):
+        for pid, written in ((1, 100), (2, 300), (3, 200)):
+            for filename in (f'{self.log}.{pid}', f'{self.log}.{pid}.1'):
+                with open(filename, 'w') as f:
+                    f.write(json.dumps({'name': f'worker {pid}'}) + '\n')
+                os.utime(filename, (written, written))
+        self.paper.parse_tei()
+        names = [record['name'] for record in read_log(self.log)]
+        self.assertEqual(sorted(names), ['Paper.parse_tei', 'worker 2', 'worker 2'])
+        self.assertEqual(len(os.listdir(self.media.name)), 4)
+
+
+class EnrichmentTests(TestCase):
+    def setUp(self):
+        FakeMetadataHandler.works = {
+            '10.1000/one': {'container-title': ['The Lancet'], 'published': {'date-parts': [[2020, 5]]},
+                            'URL': 'https://doi.org/10.1000/one'},
+            '10.1000/two': {'container-title': ['The Lancet'], 'issued': {'date-parts': [[2019, 1, 2]]}},
+        }
+        FakeMetadataHandler.requests = []
+        server = ThreadingHTTPServer(('127.0.0.1', 0), FakeMetadataHandler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        self.base_url = f'http://127.0.0.1:{server.server_port}/works/'
+        settings = override_settings(ENRICHMENT_URL=self.base_url, ENRICHMENT_RATE=1000)
+        settings.enable()
+        self.addCleanup(settings.disable)
+
+        self.media = tempfile.TemporaryDirectory()
+        self.addCleanup(self.media.cleanup)
+        media = override_settings(MEDIA_ROOT=self.media.name)
+        media.enable()
+        self.addCleanup(media.disable)
+        self.one = Paper(title='One')
+        self.one.tei.save('one.tei.xml', ContentFile(TEI.format(doi='10.1000/one', title='One')))
+        self.two = Paper.objects.create(title='Two', doi='10.1000/two', published_at=date(2019, 6, 1))
+        self.missing = Paper.objects.create(title='Missing', doi='10.1000/missing')
+
+    def test_crossref_source(self):
+        source = CrossrefSource(self.base_url)
+        self.assertEqual(source.url('10.1000/a b'), self.base_url + '10.1000/a%20b')
+        body = json.dumps({'message': FakeMetadataHandler.works['10.1000/one']})
+        self.assertEqual(source.parse(body), {
+            'journal': 'The Lancet', 'published_at': date(2020, 5, 1), 'url': 'https://doi.org/10.1000/one'})
+
+    def test_enrich_command_fills_missing_metadata_and_caches(self):
+        call_command('enrich', stdout=StringIO())
+        self.one.refresh_from_db()
+        self.two.refresh_from_db()
+        self.assertEqual(self.one.doi, '10.1000/one')
+        self.assertEqual(str(self.one.journal), 'The Lancet')
+        self.assertEqual(self.one.published_at, date(2020, 5, 1))
+        self.assertEqual(self.one.url, 'https://doi.org/10.1000/one')
+        self.assertEqual(self.two.journal, self.one.journal)
+        self.assertEqual(self.two.published_at, date(2019, 6, 1))
+        self.assertEqual(Journal.objects.count(), 1)
+        self.assertTrue(Change.objects.filter(model='paper', object_id=self.one.pk, action=Change.UPDATED).exists())
+        self.assertEqual(len(FakeMetadataHandler.requests), 3)
+
+        call_command('enrich', stdout=StringIO())
+        self.assertEqual(len(FakeMetadataHandler.requests), 3)
+        self.assertEqual(MetadataResponse.objects.get(url__endswith='missing').status, 404)
+
+        with override_settings(ENRICHMENT_CACHE_TTL=0):
+            call_command('enrich', stdout=StringIO())
+        self.assertEqual(len(FakeMetadataHandler.requests), 5)
+
+    def test_cache_evicts_least_recently_used(self):
+        urls = [self.base_url + doi for doi in ('10.1000/one', '10.1000/two', '10.1000/missing')]
+        with override_settings(ENRICHMENT_CACHE_SIZE=2):
+            cached_fetch(urls[:2], concurrency=2, rate=1000)
+            MetadataResponse.objects.filter(url=urls[0]).update(used_at=MetadataResponse.objects.get(
+                url=urls[0]).used_at - timedelta(minutes=1))
+            cached_fetch(urls[1:], concurrency=2, rate=1000)
+        self.assertEqual(sorted(MetadataResponse.objects.values_list('url', flat=True)), sorted(urls[1:]))
+
+    def test_rate_limit_is_per_host(self):
+        limiter = RateLimiter(rate=20)
+
+        async def requests():
+            loop = asyncio.get_running_loop()
+            start = loop.time()
+            await asyncio.gather(*(limiter.wait(host) for host in ('a', 'a', 'a', 'b')))
+            return loop.time() - start
+
+        elapsed = asyncio.run(requests())
+        self.assertGreaterEqual(elapsed, 0.1)
+        self.assertLess(elapsed, 0.5)
+
+
+class FacetTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.lancet = Journal.objects.create(name='The Lancet')
+        self.nature = Journal.objects.create(name='Nature')
+        self.lab = Organization.objects.create(name='Babbage Lab')
+        self.ada = Author.objects.create(forename='Ada', surname='Lovelace', organization=self.lab)
+        self.charles = Author.objects.create(forename='Charles', surname='Babbage', organization=self.lab)
+        self.one = Paper.objects.create(title='One', journal=self.lancet, published_at=date(2020, 1, 1))
+        self.two = Paper.objects.create(title='Two', journal=self.lancet, published_at=date(2021, 1, 1))
+        self.one.authors.set([self.ada, self.charles])
+
+    def counts(self):
+        return sorted(FacetCount.objects.values_list('facet', 'label', 'count'))
+
+    def test_counts_follow_paper_changes(self):
+        expected = [('journal', 'The Lancet', 2), ('organization', 'Babbage Lab', 1),
+                    ('year', '2020', 1), ('year', '2021', 1)]
+        self.assertEqual(self.counts(), expected)
+
+        self.two.journal = self.nature
+        self.two.published_at = date(2020, 6, 1)
+        self.two.save()
+        self.two.authors.add(self.ada)
+        self.assertEqual(self.counts(), [('journal', 'Nature', 1), ('journal', 'The Lancet', 1),
+                                         ('organization', 'Babbage Lab', 2), ('year', '2020', 2)])
+
+        self.ada.organization = None
+        self.ada.save()
+        self.one.delete()
+        self.lab.name = 'Analytical Engine Lab'
+        self.lab.save()
+        self.assertEqual(self.counts(), [('journal', 'Nature', 1), ('year', '2020', 1)])
+
+        FacetCount.objects.all().delete()
+        call_command('refresh_facets', stdout=StringIO())
+        self.assertEqual(self.counts(), [('journal', 'Nature', 1), ('year', '2020', 1)])
+
+    def test_counts_move_by_deltas(self):
+        # Concurrent writers each add their own delta instead of overwriting
+        # the count with one that misses the other's uncommitted paper
+        FacetCount.objects.filter(facet=facets.JOURNAL, value=self.lancet.pk).update(count=10)
+        Paper.objects.create(title='Three', journal=self.lancet)
+        self.two.journal = self.nature
+        self.two.save()
+        self.assertEqual(FacetCount.objects.get(facet=facets.JOURNAL, value=self.lancet.pk).count, 10)
+        self.assertEqual(FacetCount.objects.get(facet=facets.JOURNAL, value=self.nature.pk).count, 1)
+
+    def test_unnamed_organization_is_not_a_facet(self):
+        unnamed = Author.objects.create(forename='Grace', surname='Hopper',
+                                        organization=Organization.objects.create(name=''))
+        self.two.authors.add(unnamed)
+        expected = [('journal', 'The Lancet', 2), ('organization', 'Babbage Lab', 1),
+                    ('year', '2020', 1), ('year', '2021', 1)]
+        self.assertEqual(self.counts(), expected)
+        call_command('refresh_facets', stdout=StringIO())
+        self.assertEqual(self.counts(), expected)
+
+    def test_browse_is_cached_until_papers_change(self):
+        response = self.client.get('/', {'journal': self.lancet.pk})
+        self.assertContains(response, 'Babbage Lab')
+        self.assertContains(response, '2 papers')
+        with self.assertNumQueries(0):
+            self.client.get('/', {'journal': self.lancet.pk})
+
+        self.one.delete()
+        response = self.client.get('/', {'journal': self.lancet.pk, 'organization': self.lab.pk})
+        self.assertContains(response, '0 papers')
+        response = self.client.get('/', {'q': 'tw'})
+        self.assertContains(response, '1 paper')
+        self.assertContains(response, 'Two')
+
+
+@override_settings(DATABASE_REPLICAS=['replica'])
+class ReplicaRoutingTests(TestCase):
+    # A second test database stands in for a replica that hasn't caught up
+    databases = {'default', 'replica'}
+
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(_pinned.reset, _pinned.set(False))
+        Paper.objects.create(title='Only on the primary', url='https://example.com/primary')
+        _pinned.set(False)
+        Paper.objects.using('replica').bulk_create([Paper(title='Replicated', url='https://example.com/replica')])
+
+    def test_replicas_are_never_migrated(self):
+        self.assertFalse(router.allow_migrate('replica', 'medseer', model_name='paper'))
+        self.assertTrue(router.allow_migrate('default', 'medseer', model_name='paper'))
+
+    def test_reads_go_to_the_replica_until_a_write(self):
+        self.assertEqual(Paper.objects.all().db, 'default')
+        with read_only():
+            self.assertEqual(list(Paper.objects.values_list('title', flat=True)), ['Replicated'])
+            Journal.objects.create(name='The Lancet')
+            self.assertEqual(Paper.objects.count(), 1)
+            self.assertEqual(Paper.objects.get().title, 'Only on the primary')
+        with read_only():
+            self.assertEqual(Paper.objects.all().db, 'default')
+
+    @override_settings(SYNC_SETTLE_SECONDS=0)
+    def test_sync_reads_changes_from_the_primary(self):
+        # The replica already shows a later change but not the earlier one
+        # before it, which a cursor read there would skip for good
+        primary = list(Change.objects.values_list('id', flat=True))
+        Change.objects.using('replica').bulk_create(
+            [Change(id=primary[-1] + 1, model='journal', object_id=1, action=Change.CREATED)])
+        self.client.force_login(User.objects.create_superuser('admin', 'admin@example.com', 'secret'))
+        response = self.client.get('/api/sync/')
+        changes = [json.loads(line) for line in b''.join(response.streaming_content).decode().splitlines()]
+        self.assertEqual([change['cursor'] for change in changes][:len(primary)], primary)
+        self.assertNotIn(primary[-1] + 1, [change['cursor'] for change in changes])
+        self.assertGreaterEqual(int(response['X-Sync-Cursor']), primary[-1])
+
+    def test_views_read_from_the_replica_and_stick_to_the_primary_after_writes(self):
+        self.client.force_login(User.objects.create_superuser('admin', 'admin@example.com', 'secret'))
+        self.assertContains(self.client.get('/'), 'Replicated')
+        self.assertNotIn(PIN_COOKIE, self.client.cookies)
+
+        response = self.client.post('/admin/medseer/paper/add/', {'title': 'Fresh', 'url': 'https://example.com/fresh'})
+        self.assertEqual(response.status_code, 302)
+        self.assertIn(PIN_COOKIE, response.cookies)
+        # A visitor reading from the lagging replica must not cache a page the writer is then served
+        visitor = self.client_class()
+        self.assertNotContains(visitor.get('/'), 'Fresh')
+        response = self.client.get('/')
+        self.assertContains(response, 'Fresh')
+        self.assertNotContains(response, 'Replicated')
+        self.assertNotIn(PIN_COOKIE, response.cookies)
+
+        self.client.cookies.pop(PIN_COOKIE)
+        self.assertContains(self.client.get('/'), 'Replicated')
+
+
+class DuplicateTests(TestCase):
+    abstract = ('We describe an analytical engine able to compute any function of its inputs, '
+                'programmed with punched cards and storing numbers in a mill of fifty digits.')
+
+    def setUp(self):
+        self.lab = Organization.objects.create(name='Babbage Lab')
+        self.ada = Author.objects.create(forename='Ada', surname='Lovelace', organization=self.lab)
+        self.published = Paper.objects.create(title='Sketch of the Analytical Engine', abstract=self.abstract,
+                                              doi='10.1000/engine')
+
+    def test_fingerprints_ignore_case_punctuation_and_accents(self):
+        self.assertEqual(duplicates.normalize('Sketch of the  Analytical-Engine: Notes, Édition'),
+                         'sketch of the analytical engine notes edition')
+        title_key, signature = duplicates.fingerprint('SKETCH of the analytical engine.', self.abstract)
+        self.assertEqual(title_key, PaperFingerprint.objects.get(paper=self.published).title_key)
+        edited = duplicates.minhash('Sketch of the Analytical Engine ' + self.abstract.replace('fifty', 'forty'))
+        unrelated = duplicates.minhash('On the nature of heat and the motive power of fire')
+        self.assertGreater(duplicates.similarity(signature, edited), 0.7)
+        self.assertLess(duplicates.similarity(signature, unrelated), 0.2)
+        self.assertEqual(PaperBucket.objects.filter(paper=self.published).count(), duplicates.BANDS)
+
+    def test_new_papers_are_checked_against_indexed_ones(self):
+        preprint = Paper.objects.create(title='A sketch of the analytical engine',
+                                        abstract=self.abstract.replace('fifty', 'forty'))
+        Paper.objects.create(title='On the motive power of fire', abstract='Heat engines and their efficiency.')
+        candidate = DuplicateCandidate.objects.get()
+        self.assertEqual((candidate.paper, candidate.duplicate), (self.published, preprint))
+        self.assertFalse(candidate.same_title)
+        self.assertGreater(candidate.similarity, 0.7)
+
+        with self.assertNumQueries(2):
+            self.assertEqual([paper_id for paper_id, score, same_title in duplicates.candidates(
+                'SKETCH OF THE ANALYTICAL ENGINE', '')], [self.published.pk])
+            self.assertEqual(duplicates.candidates('Unrelated', 'Nothing like it at all.'), [])
+
+        candidate.dismissed = True
+        candidate.save()
+        call_command('index_duplicates', rebuild=True, stdout=StringIO())
+        self.assertTrue(DuplicateCandidate.objects.get().dismissed)
+
+    def test_admin_merges_candidates(self):
+        preprint = Paper.objects.create(title='Sketch of the Analytical Engine.', abstract=self.abstract,
+                                        url='https://example.com/preprint', published_at=date(1843, 1, 1))
+        preprint.authors.add(self.ada)
+        self.assertTrue(DuplicateCandidate.objects.get().same_title)
+
+        self.client.force_login(User.objects.create_superuser('admin', 'admin@example.com', 'secret'))
+        response = self.client.post('/admin/medseer/duplicatecandidate/', {
+            'action': 'merge',
+            '_selected_action': list(DuplicateCandidate.objects.values_list('pk', flat=True)),
+        }, follow=True)
+        self.assertContains(response, 'Merged 1 papers')
+        paper = Paper.objects.get()
+        self.assertEqual((paper.pk, paper.doi, paper.url), (self.published.pk, '10.1000/engine',
+                                                            'https://example.com/preprint'))
+        self.assertEqual(list(paper.authors.all()), [self.ada])
+        self.assertFalse(DuplicateCandidate.objects.exists())
+
+    def test_admin_merges_a_chain_of_candidates(self):
+        draft = Paper.objects.create(title='Sketch of the Analytical Engine.', abstract=self.abstract)
+        preprint = Paper.objects.create(title='Sketch of the Analytical Engine!', abstract=self.abstract,
+                                        url='https://example.com/preprint')
+        preprint.authors.add(self.ada)
+        # The draft takes in the preprint first, then is merged itself
+        DuplicateCandidate.objects.all().delete()
+        DuplicateCandidate.objects.bulk_create([
+            DuplicateCandidate(paper=draft, duplicate=preprint, similarity=0.9),
+            DuplicateCandidate(paper=self.published, duplicate=draft, similarity=0.8),
+        ])
+
+        self.client.force_login(User.objects.create_superuser('admin', 'admin@example.com', 'secret'))
+        response = self.client.post('/admin/medseer/duplicatecandidate/', {
+            'action': 'merge',
+            '_selected_action': list(DuplicateCandidate.objects.values_list('pk', flat=True)),
+        }, follow=True)
+        self.assertContains(response, 'Merged 2 papers')
+        paper = Paper.objects.get()
+        self.assertEqual((paper.pk, paper.url), (self.published.pk, 'https://example.com/preprint'))
+        self.assertEqual(list(paper.authors.all()), [self.ada])
+
+    def test_benchmark_command(self):
+        out = StringIO()
+        call_command('benchmark_duplicates', papers=300, queries=10, stdout=out)
+        self.assertIn('found 10/10 near-duplicates, 0 false matches', out.getvalue())
+        self.assertEqual(Paper.objects.count(), 1)
+
+
+def sequential_scans(plan):
+    """Tables a query plan reads in full (SQLite or PostgreSQL EXPLAIN output)."""
+    if connection.vendor == 'postgresql':
+        return re.findall(r'Seq Scan on (\w+)', plan)
+    return [table for table, using in re.findall(r'SCAN (\w+)( USING)?', plan) if not using]
+
+
+class QueryPlanTests(TestCase):
+    """Fails when the hot admin, API and browse queries stop using indexes."""
+
+    @classmethod
+    def setUpTestData(cls):
+        journals = Journal.objects.bulk_create(Journal(name=f'Journal {i}') for i in range(50))
+        organizations = Organization.objects.bulk_create(Organization(name=f'Lab {i}') for i in range(50))
+        authors = Author.objects.bulk_create(
+            Author(forename=f'Forename {i}', surname=f'Surname {i}', organization=organizations[i % 50])
+            for i in range(2000))
+        start = datetime(2020, 1, 1, tzinfo=timezone.utc)
+        papers = Paper.objects.bulk_create(
+            Paper(title=f'Paper {i}', doi=f'10.1000/{i}', url=f'https://example.com/{i}',
+                  journal=journals[i % 50], published_at=date(1990 + i % 30, 1 + i % 12, 1))
+            for i in range(5000))
+        Paper.authors.through.objects.bulk_create(
+            Paper.authors.through(paper=paper, author=authors[i % 2000]) for i, paper in enumerate(papers))
+        Paper.objects.filter(pk__in=[paper.pk for paper in papers[::100]]).update(url=None)
+        for i, model in enumerate((Paper, Author)):
+            for j, instance in enumerate(model.objects.order_by('pk')):
+                model.objects.filter(pk=instance.pk).update(
+                    created_at=start + timedelta(hours=j), modified_at=start + timedelta(hours=j, minutes=i))
+        Change.objects.bulk_create(Change(model='paper', object_id=paper.pk, action=Change.CREATED)
+                                   for paper in papers)
+        facets.rebuild()
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+        cls.journal = journals[7]
+
+    def hot_queries(self):
+        week = datetime(2020, 3, 1, tzinfo=timezone.utc)
+        yield 'admin paper changelist', Paper.objects.order_by('-created_at', '-modified_at', '-pk')[:100]
+        yield 'admin date hierarchy', Paper.objects.filter(modified_at__gte=week,
+                                                           modified_at__lt=week + timedelta(days=7))
+        yield 'admin author by surname', Author.objects.filter(surname='Surname 42')
+        yield 'browse', Paper.objects.order_by('-published_at', 'title')[:20]
+        yield 'browse by journal', Paper.objects.filter(journal=self.journal).order_by('-published_at', 'title')[:20]
+        yield 'browse by year', Paper.objects.filter(published_at__year=2001).order_by('-published_at', 'title')[:20]
+        yield 'facet sidebar', FacetCount.objects.filter(facet=FacetCount.JOURNAL).order_by('-count', 'label')[:15]
+        yield 'sync feed', Change.objects.filter(id__gt=4000).order_by('id')[:1000]
+        yield 'enrich incomplete', Paper.objects.filter(INCOMPLETE).order_by('pk')[:200]
+        title_hash = hashlib.md5(b'paper 42').hexdigest()
+        yield 'unique title', Paper.objects.alias(title_hash=MD5(Lower('title'))).filter(title_hash=title_hash)
+        yield 'unique doi', Paper.objects.alias(doi_lower=Lower('doi')).filter(doi_lower__in=['10.1000/42'])
+        if connection.vendor == 'postgresql':
+            yield 'title search', Paper.objects.filter(title__icontains='per 42')
+            yield 'admin author search', Author.objects.filter(surname__icontains='name 42')
+
+    def test_hot_queries_use_indexes(self):
+        for name, queryset in self.hot_queries():
+            with self.subTest(name):
+                plan = queryset.explain()
+                self.assertEqual(sequential_scans(plan), [], f'{name}:\n{plan}')
+
+    def test_title_and_doi_are_unique_regardless_of_case(self):
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            Paper.objects.create(title='PAPER 1')
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            Paper.objects.create(title='Another paper', doi='10.1000/1'.upper())
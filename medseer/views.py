@@ -1,3 +1,103 @@
+import hashlib
+import json
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.paginator import Paginator
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import JsonResponse, StreamingHttpResponse
 from django.shortcuts import render
+from django.template.loader import render_to_string
+from django.utils.http import urlencode
+from drf_spectacular.types import OpenApiTypes
+from drf_spectacular.utils import OpenApiParameter, extend_schema
+from rest_framework.decorators import api_view, permission_classes
+from rest_framework.permissions import IsAdminUser
+
+from . import facets
+from .models import FacetCount, Paper
+from .routers import pinned, read_only
+from .sync import iter_changes, latest_cursor
+
+SYNC_LIMIT = 10000
+BROWSE_PAGE_SIZE = 20
+BROWSE_FACET_SIZE = 15
+
+
+@extend_schema(
+        parameters=[
+            OpenApiParameter('since', OpenApiTypes.INT,
+                             description='Cursor returned by the previous call (0 for a full sync)'),
+            OpenApiParameter('limit', OpenApiTypes.INT,
+                             description=f'Maximum number of changes to return (at most {SYNC_LIMIT})'),
+        ],
+        description='Stream changes to papers, authors, journals and organizations as '
+                    'newline-delimited JSON. Poll again with the X-Sync-Cursor header as `since`.',
+        responses=OpenApiTypes.STR,
+     )
+@api_view(['GET'])
+# Streams every row, author emails included
+@permission_classes([IsAdminUser])
+def sync(request):
+    try:
+        since = int(request.GET.get('since', 0))
+        limit = int(request.GET.get('limit', SYNC_LIMIT))
+    except ValueError:
+        return JsonResponse({'error': 'since and limit must be integers'}, status=400)
+    if since < 0 or not 0 < limit <= SYNC_LIMIT:
+        return JsonResponse({'error': f'since must be >= 0 and limit within 1..{SYNC_LIMIT}'}, status=400)
+
+    # Read from the primary: on a lagging replica a higher change id can be
+    # visible before a lower one committed earlier, and the cursor would
+    # skip it for good (see latest_cursor)
+    until = latest_cursor(since, limit)
+    lines = (json.dumps(change, cls=DjangoJSONEncoder) + '\n'
+             for change in iter_changes(since, until))
+    response = StreamingHttpResponse(lines, content_type='application/x-ndjson')
+    response['X-Sync-Cursor'] = until
+    return response
+
+
+@read_only()
+def browse(request):
+    selected = {facet: int(request.GET[facet]) for facet, label in FacetCount.FACET_CHOICES
+                if request.GET.get(facet, '').isdigit()}
+    query = request.GET.get('q', '').strip()
+    params = sorted((key, value) for key, value in request.GET.items() if key != 'page')
+    version = facets.version()
+
+    # Facet counts are precomputed, so the sidebar costs O(facets) and is
+    # cached together with the result lists until the papers change. A session
+    # that just wrote reads the primary and bypasses the cache, which may hold
+    # pages rendered from a replica that hadn't caught up with the write yet.
+    cached = not pinned()
+    sidebar_key = f'medseer:browse:facets:{version}'
+    sidebar = cache.get(sidebar_key) if cached else None
+    if sidebar is None:
+        sidebar = [(facet, label, facets.top(facet, BROWSE_FACET_SIZE)) for facet, label in FacetCount.FACET_CHOICES]
+        if cached:
+            cache.set(sidebar_key, sidebar, settings.BROWSE_CACHE_TIMEOUT)
+
+    digest = hashlib.md5(json.dumps([params, request.GET.get('page', '1')]).encode()).hexdigest()
+    results_key = f'medseer:browse:results:{version}:{digest}'
+    results = cache.get(results_key) if cached else None
+    if results is None:
+        papers = Paper.objects.select_related('journal').prefetch_related('authors').order_by('-published_at', 'title')
+        for facet, value in selected.items():
+            papers = facets.papers(facet, value, papers)
+        if query:
+            papers = papers.filter(title__icontains=query)
+        page = Paginator(papers, BROWSE_PAGE_SIZE).get_page(request.GET.get('page'))
+        results = render_to_string('medseer/paper_list.html', {
+            'page': page,
+            'params': urlencode(params),
+        }, request)
+        if cached:
+            cache.set(results_key, results, settings.BROWSE_CACHE_TIMEOUT)
 
-# Create your views here.
+    return render(request, 'medseer/browse.html', {
+        'facets': sidebar,
+        'selected': selected,
+        'query': query,
+        'results': results,
+    })
@@ -28,6 +28,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'medseer.profiling.ProfilingMiddleware',
+    'medseer.routers.ReplicaMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'whitenoise.middleware.WhiteNoiseMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
@@ -121,3 +123,45 @@ SPECTACULAR_SETTINGS = {
     'DESCRIPTION': 'API for Django REST app',
     'VERSION': '1.0.0',
 }
+
+# Seconds a recorded change waits before the sync API serves it, which must
+# exceed the longest transaction recording changes (see medseer.sync)
+SYNC_SETTLE_SECONDS = int(os.environ.get('SYNC_SETTLE_SECONDS', 60))
+
+# Cold start budget checked by `python manage.py importtime` and the app tests;
+# django.setup() measures 300-450 ms, so this leaves a modest margin and
+# catches a regression of a few heavy imports
+IMPORT_TIME_BUDGET_MS = float(os.environ.get('IMPORT_TIME_BUDGET_MS', 600))
+
+# Profiling of requests, admin actions and TEI parsing (see medseer.profiling);
+# a sample rate of 0 disables it, 1 records every operation. Each process
+# logs to PROFILING_LOG.<pid>, rotated at PROFILING_LOG_MAX_BYTES; only the
+# logs of the PROFILING_LOG_MAX_FILES most recently written processes are kept
+PROFILING_SAMPLE_RATE = float(os.environ.get('PROFILING_SAMPLE_RATE', 0))
+PROFILING_LOG = os.environ.get('PROFILING_LOG', os.path.join(BASE_DIR, 'profiling.log'))
+PROFILING_LOG_MAX_BYTES = int(os.environ.get('PROFILING_LOG_MAX_BYTES', 10 * 1024 * 1024))
+PROFILING_LOG_MAX_FILES = int(os.environ.get('PROFILING_LOG_MAX_FILES', 16))
+
+# Metadata enrichment of papers by DOI (see medseer.enrichment)
+ENRICHMENT_SOURCE = os.environ.get('ENRICHMENT_SOURCE', 'medseer.enrichment.CrossrefSource')
+ENRICHMENT_URL = os.environ.get('ENRICHMENT_URL', 'https://api.crossref.org/works/')
+ENRICHMENT_CONCURRENCY = int(os.environ.get('ENRICHMENT_CONCURRENCY', 8))
+# Requests per second per host
+ENRICHMENT_RATE = float(os.environ.get('ENRICHMENT_RATE', 5))
+ENRICHMENT_CACHE_TTL = int(os.environ.get('ENRICHMENT_CACHE_TTL', 30 * 24 * 60 * 60))
+ENRICHMENT_CACHE_SIZE = int(os.environ.get('ENRICHMENT_CACHE_SIZE', 100000))
+
+# Seconds the public browse page keeps facet lists and result pages cached;
+# entries are also invalidated whenever papers change
+BROWSE_CACHE_TIMEOUT = int(os.environ.get('BROWSE_CACHE_TIMEOUT', 300))
+
+# Read replicas (aliases in DATABASES) that read-only views are served from;
+# a session reads from the primary for REPLICA_PIN_SECONDS after writing,
+# which should exceed the replication lag
+DATABASE_ROUTERS = ['medseer.routers.ReplicaRouter']
+DATABASE_REPLICAS = []
+REPLICA_PIN_SECONDS = int(os.environ.get('REPLICA_PIN_SECONDS', 5))
+
+# Estimated title+abstract similarity (0..1) above which a new paper is
+# flagged as a possible duplicate of an existing one (see medseer.duplicates)
+DUPLICATE_THRESHOLD = float(os.environ.get('DUPLICATE_THRESHOLD', 0.7))
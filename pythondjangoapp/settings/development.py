@@ -14,3 +14,10 @@ DATABASES = {
         'NAME': os.path.join(os.path.abspath(BASE_DIR), 'db.sqlite3'),
     }
 }
+
+# Stand-in for a read replica; only used when listed in DATABASE_REPLICAS,
+# as the tests do (nothing replicates into it)
+DATABASES['replica'] = {
+    'ENGINE': 'django.db.backends.sqlite3',
+    'NAME': os.path.join(os.path.abspath(BASE_DIR), 'db-replica.sqlite3'),
+}
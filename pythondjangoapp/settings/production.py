@@ -16,3 +16,10 @@ DATABASES = {
         'PORT': os.environ['POSTGRES_PORT'],
     }
 }
+
+# Comma-separated host[:port] of streaming replicas of the database above
+for i, replica in enumerate(filter(None, os.environ.get('POSTGRES_REPLICA_HOSTS', '').split(','))):
+    host, _, port = replica.strip().partition(':')
+    DATABASES[f'replica{i}'] = dict(DATABASES['default'], HOST=host, PORT=port or DATABASES['default']['PORT'],
+                                    TEST={'MIRROR': 'default'})
+    DATABASE_REPLICAS.append(f'replica{i}')
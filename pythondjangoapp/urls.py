@@ -6,6 +6,7 @@ from django.urls import path
 
 urlpatterns = [
     path('admin/', admin.site.urls),
+    path('api/', include('medseer.urls')),
     path('', include('app.urls')),
 ]
 